@@ -0,0 +1,99 @@
+"""Benchmark for RSA decryption latency and throughput."""
+import os
+import sys
+import time
+from os.path import dirname, join, abspath
+import rsa
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from encryption import EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY
+from encryption import start_decrypt_pool, decrypt_many, DecryptContext, load_priv_key
+
+
+def make_blocks(count: int, public_key: rsa.PublicKey = EXAMPLE_PUB_KEY) -> list:
+    """
+    Encrypt random single-block messages.
+
+    :param count: The number of blocks.
+    :param public_key: The public key to encrypt with.
+    :return: The list of encrypted blocks.
+    """
+    return [rsa.encrypt(os.urandom(200), public_key) for _ in range(count)]
+
+
+def bench_serial(blocks: list, private_key: rsa.PrivateKey = EXAMPLE_PRIV_KEY) -> float:
+    """
+    Decrypt the blocks one after the other.
+
+    :param blocks: The encrypted blocks.
+    :param private_key: The private key to decrypt with.
+    :return: The number of blocks decrypted per second.
+    """
+    start = time.perf_counter()
+    for block in blocks:
+        rsa.decrypt(block, private_key)
+    return len(blocks) / (time.perf_counter() - start)
+
+
+def bench_latency(blocks: list, decrypt_func) -> float:
+    """
+    Measure the mean latency of a decryption function.
+
+    :param blocks: The encrypted blocks.
+    :param decrypt_func: The function decrypting one block.
+    :return: The mean latency of one decryption in microseconds.
+    """
+    start = time.perf_counter_ns()
+    for block in blocks:
+        decrypt_func(block)
+    return (time.perf_counter_ns() - start) / len(blocks) / 1000
+
+
+def bench_parallel(blocks: list,
+                   workers: int,
+                   batch_size: int = 32,
+                   private_key: rsa.PrivateKey = EXAMPLE_PRIV_KEY) -> float:
+    """
+    Decrypt the blocks with a process pool.
+
+    :param blocks: The encrypted blocks.
+    :param workers: The number of worker processes.
+    :param batch_size: The number of blocks in each batch.
+    :param private_key: The private key to decrypt with.
+    :return: The number of blocks decrypted per second.
+    """
+    with start_decrypt_pool(private_key, workers=workers) as pool:
+        # Start the workers before timing
+        decrypt_many(pool, blocks[:workers], batch_size=1)
+        start = time.perf_counter()
+        decrypt_many(pool, blocks, batch_size=batch_size)
+        return len(blocks) / (time.perf_counter() - start)
+
+
+def main(count: int = 500) -> None:
+    """
+    Print the decryption latency of each path, and the throughput for each number of workers.
+
+    :param count: The number of blocks to decrypt.
+    :return: None.
+    """
+    blocks = make_blocks(count)
+    keypath = join(dirname(__file__), '..', 'encryption', 'example_keys', 'keys_2048_priv.pem')
+    context = DecryptContext(EXAMPLE_PRIV_KEY)
+    latencies = {
+        'load_priv_key + rsa.decrypt': lambda block: rsa.decrypt(block, load_priv_key(keypath)),
+        'rsa.decrypt': lambda block: rsa.decrypt(block, EXAMPLE_PRIV_KEY),
+        'DecryptContext.decrypt': context.decrypt,
+        'DecryptContext.decrypt without blinding': DecryptContext(
+            EXAMPLE_PRIV_KEY, blinding=False).decrypt,
+    }
+    for name, decrypt_func in latencies.items():
+        print(f"{name}: {bench_latency(blocks, decrypt_func):.0f} us per decrypt")
+    print(f"serial: {bench_serial(blocks):.0f} blocks/s")
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        print(f"{workers} workers: {bench_parallel(blocks, workers):.0f} blocks/s")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
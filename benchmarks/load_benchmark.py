@@ -0,0 +1,279 @@
+"""Load benchmark driving a local headless server with concurrent clients."""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import tempfile
+import itertools
+import subprocess
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Union
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+import cs_network
+from cs_network import Client, process_data
+from cs_network.metrics import percentile, PERCENTILES
+
+SERIALIZE = {'pickle': 1, 'json': 2, 'xml': 3, 'msgpack': 4}
+ROOT = abspath(join(dirname(__file__), '..'))
+
+
+def make_payload(size: int) -> dict:
+    """
+    Build a dictionary of about the given serialized size.
+
+    :param size: The approximate size in bytes.
+    :return: The dictionary.
+    """
+    return {f'key{num}': f'{num:06d}' + 'x' * 84 for num in range(max(size // 100, 1))}
+
+
+def free_port(host: str) -> int:
+    """
+    Find a port to start the server on.
+
+    :param host: The host of the server.
+    :return: A port that is free at the moment.
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(host: str,
+                 port: int,
+                 workers: int,
+                 log_dir: Union[str, None] = None,
+                 startup_timeout: float = 10) -> subprocess.Popen:
+    """
+    Start the headless server and wait until it accepts connections.
+
+    :param host: The host to bind to.
+    :param port: The port to bind to.
+    :param workers: The number of connections served at the same time.
+    :param log_dir: The folder of the output log, or None to print the data to the console.
+    :param startup_timeout: The seconds to wait for the server to accept connections.
+    :return: The server process.
+    """
+    command = [sys.executable, '-m', 'cs_network', '--host', host, '--port', str(port),
+               '--workers', str(workers), '--backlog', str(workers), '--drain-timeout', '1']
+    if log_dir is not None:
+        command += ['--output-dir', log_dir, '--log']
+    # The console output of the server is discarded, it is still formatted and written
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with {process.returncode}.")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError("The server did not start.")
+
+
+def server_memory(pid: int) -> dict:
+    """
+    Read the resident memory of a process, on Linux.
+
+    :param pid: The process id.
+    :return: {'rss_mb': ..., 'peak_rss_mb': ...}, None when the memory cannot be read.
+    """
+    memory = {'rss_mb': None, 'peak_rss_mb': None}
+    try:
+        with open(f'/proc/{pid}/status', encoding='utf-8') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    memory['rss_mb'] = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    memory['peak_rss_mb'] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return memory
+
+
+def run_client(host: str,
+               port: int,
+               serialize: int,
+               encrypt: int,
+               payload: dict,
+               messages: int,
+               barrier,
+               results) -> None:
+    """
+    Send messages one after the other from a client process, timing each response.
+
+    :param host: The host of the server.
+    :param port: The port of the server.
+    :param serialize: The serialization of the messages.
+    :param encrypt: 1 to encrypt the messages, 2 to send them in plain.
+    :param payload: The dictionary to send.
+    :param messages: The number of messages to send.
+    :param barrier: Waited on by every client once connected, so they start together.
+    :param results: The queue to put the (start, end, latencies, errors) of the client on.
+    :return: None.
+    """
+    latencies = []
+    errors = 0
+    with Client(host, port, serialize=serialize, encrypt=encrypt) as client:
+        barrier.wait()
+        start = time.monotonic()
+        for _ in range(messages):
+            sent = time.perf_counter_ns()
+            if client.send(payload) != 'DATA_OK':
+                errors += 1
+            latencies.append(time.perf_counter_ns() - sent)
+        end = time.monotonic()
+    results.put((start, end, latencies, errors))
+
+
+def run_case(host: str,
+             port: int,
+             serialize: int,
+             encrypt: int,
+             payload: dict,
+             clients: int,
+             messages: int) -> dict:
+    """
+    Run concurrent clients against the server.
+
+    :param host: The host of the server.
+    :param port: The port of the server.
+    :param serialize: The serialization of the messages.
+    :param encrypt: 1 to encrypt the messages, 2 to send them in plain.
+    :param payload: The dictionary to send.
+    :param clients: The number of concurrent clients.
+    :param messages: The number of messages sent by each client.
+    :return: The time of the slowest client, the latencies in nanoseconds, and the errors.
+    """
+    barrier = multiprocessing.Barrier(clients)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=run_client,
+        args=(host, port, serialize, encrypt, payload, messages, barrier, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return {
+        'seconds': max(report[1] for report in reports) - min(report[0] for report in reports),
+        'latencies': sorted(itertools.chain.from_iterable(report[2] for report in reports)),
+        'errors': sum(report[3] for report in reports),
+    }
+
+
+def sweep(args: argparse.Namespace) -> list:
+    """
+    Run every combination of payload size, serialization, encryption and client count.
+
+    :param args: The options from parse_args.
+    :return: The result of each combination.
+    """
+    cases = []
+    for size, name, encrypt in itertools.product(args.sizes, args.serialize, args.encrypt):
+        # Encrypted dictionaries are always serialized to binary by the client
+        case = (size, 'pickle' if encrypt == 'on' else name, encrypt)
+        if case not in cases:
+            cases.append(case)
+    results = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        port = free_port(args.host)
+        server = start_server(args.host, port, max(args.clients), log_dir if args.log else None)
+        try:
+            for (size, name, encrypt), clients in itertools.product(cases, args.clients):
+                payload = make_payload(size)
+                encrypt_type = 1 if encrypt == 'on' else 2
+                message_size = len(process_data(
+                    {'type': 1, 'encrypt': 2, 'serialize': SERIALIZE[name]}, payload)[1])
+                run = run_case(args.host, port, SERIALIZE[name], encrypt_type, payload,
+                               clients, args.messages)
+                count = clients * args.messages
+                result = {
+                    'payload_bytes': message_size,
+                    'serialize': name,
+                    'encrypt': encrypt == 'on',
+                    'clients': clients,
+                    'messages': count,
+                    'errors': run['errors'],
+                    'seconds': run['seconds'],
+                    'messages_per_s': count / run['seconds'],
+                    'mb_per_s': count * message_size / 1e6 / run['seconds'],
+                    'latency_ms': {f'p{percent}': percentile(run['latencies'], percent) / 1e6
+                                   for percent in PERCENTILES} | {
+                                       'max': run['latencies'][-1] / 1e6},
+                } | server_memory(server.pid)
+                results.append(result)
+                print(f"{message_size:>8} B {name:<7} encrypt {encrypt:<3} {clients:>3} clients: "
+                      f"{result['messages_per_s']:8.0f} msg/s {result['mb_per_s']:7.1f} MB/s "
+                      f"p50 {result['latency_ms']['p50']:7.2f} ms "
+                      f"p99 {result['latency_ms']['p99']:7.2f} ms "
+                      f"rss {result['rss_mb'] or 0:6.1f} MB"
+                      + (f", {run['errors']} errors" if run['errors'] else ''))
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def parse_args(argv: Union[list, None] = None) -> argparse.Namespace:
+    """
+    Parse the command line options of the benchmark.
+
+    :param argv: The command line arguments, defaults to sys.argv.
+    :return: The parsed options.
+    """
+    parser = argparse.ArgumentParser(
+        description="Drive a local server with concurrent clients and record the throughput.")
+    parser.add_argument('--host', default='127.0.0.1', help="The host to start the server on.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10_000, 100_000],
+                        help="The approximate payload sizes in bytes.")
+    parser.add_argument('--serialize', nargs='+', choices=list(SERIALIZE),
+                        default=['pickle', 'json', 'xml'], help="The serializations.")
+    parser.add_argument('--encrypt', nargs='+', choices=['off', 'on'], default=['off', 'on'],
+                        help="Send the messages in plain, encrypted, or both.")
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16],
+                        help="The numbers of concurrent clients.")
+    parser.add_argument('--messages', type=int, default=200,
+                        help="The number of messages sent by each client.")
+    parser.add_argument('--log', action='store_true',
+                        help="Append the data to the server's segmented log instead of "
+                        "printing it.")
+    parser.add_argument('--output', default='load_benchmark.json',
+                        help="The JSON file to write the results to.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[list, None] = None) -> None:
+    """
+    Run the sweep and write the results with the environment to a JSON file.
+
+    :param argv: The command line arguments, defaults to sys.argv.
+    :return: None.
+    """
+    args = parse_args(argv)
+    started = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    results = sweep(args)
+    report = {
+        'version': cs_network.__version__,
+        'started': started,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark for the size and speed of each serialization method."""
+import sys
+import json
+import time
+import pickle
+from xml.dom.minidom import parseString
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from cs_network import dict_to_xml_string
+from cs_network.binary import packb, unpackb
+from cs_network.compression import compress, decompress, METHODS
+
+
+def make_record(width: int = 10, depth: int = 3) -> dict:
+    """
+    Build a nested dictionary like the ones entered in the client.
+
+    :param width: The number of keys in each dictionary.
+    :param depth: The number of nested levels.
+    :return: The dictionary.
+    """
+    record = {f'key{num}': f'value{num}' for num in range(width)}
+    if depth > 1:
+        record['nested_dict'] = make_record(width, depth - 1)
+    return record
+
+
+def bench(encode, decode, record: dict, repeat: int) -> tuple:
+    """
+    Measure the serialized size, and the mean encode and decode times.
+
+    :param encode: The function serializing the record to bytes.
+    :param decode: The function deserializing the bytes.
+    :param record: The record to serialize.
+    :param repeat: The number of times to repeat each measurement.
+    :return: The size in bytes, and the encode and decode times in microseconds.
+    """
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        encoded = encode(record)
+    encode_time = (time.perf_counter_ns() - start) / repeat / 1000
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        decode(encoded)
+    decode_time = (time.perf_counter_ns() - start) / repeat / 1000
+    return len(encoded), encode_time, decode_time
+
+
+def bench_compression(data: bytes, link_mbps: float = 100, repeat: int = 20) -> None:
+    """
+    Print the size and speed of each compression method, and the time to send over a link.
+
+    :param data: The serialized data.
+    :param link_mbps: The bandwidth of the link in megabits per second.
+    :param repeat: The number of times to repeat each measurement.
+    :return: None.
+    """
+    print(f"  uncompressed: {len(data)} bytes, send {len(data) * 8 / link_mbps / 1000:.1f} ms")
+    for method in METHODS:
+        for level in (1, 6, 9):
+            start = time.perf_counter_ns()
+            for _ in range(repeat):
+                compressed = compress(data, method, level)
+            compress_time = (time.perf_counter_ns() - start) / repeat / 1e6
+            start = time.perf_counter_ns()
+            for _ in range(repeat):
+                decompress(compressed, method)
+            decompress_time = (time.perf_counter_ns() - start) / repeat / 1e6
+            send_time = len(compressed) * 8 / link_mbps / 1000
+            print(f"  {method} level {level}: {len(compressed)} bytes, "
+                  f"compress {compress_time:.1f} ms, decompress {decompress_time:.1f} ms, "
+                  f"total with send {compress_time + send_time + decompress_time:.1f} ms")
+
+
+def main(repeat: int = 2000) -> None:
+    """
+    Print the size and speed of each serialization method for small and large records.
+
+    :param repeat: The number of times to repeat each measurement.
+    :return: None.
+    """
+    methods = {
+        '(1) Binary': (pickle.dumps, pickle.loads),
+        '(2) JSON': (lambda record: json.dumps(record).encode('utf-8'),
+                     lambda data: json.loads(data.decode('utf-8'))),
+        '(3) XML': (dict_to_xml_string, parseString),
+        '(4) MessagePack': (packb, unpackb),
+    }
+    for width, depth in ((3, 1), (10, 3), (100, 5)):
+        record = make_record(width, depth)
+        print(f"Record of {width} keys and {depth} levels:")
+        for name, (encode, decode) in methods.items():
+            size, encode_time, decode_time = bench(encode, decode, record, repeat // depth)
+            print(f"  {name}: {size} bytes, encode {encode_time:.1f} us, "
+                  f"decode {decode_time:.1f} us")
+    record = make_record(100, 5)
+    for name, encode in (('JSON', methods['(2) JSON'][0]), ('XML', dict_to_xml_string)):
+        print(f"Compression of the {name} record of 100 keys and 5 levels over 100 Mbit/s:")
+        bench_compression(encode(record))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark for converting large and deeply nested dictionaries to XML."""
+import sys
+import time
+import xml.etree.ElementTree as ET
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from cs_network import dict_to_xml_string
+
+
+def make_wide(elements: int) -> dict:
+    """
+    Build a dictionary of records with ten values each.
+
+    :param elements: The approximate number of elements.
+    :return: The dictionary.
+    """
+    return {f'record{num}': {f'key{key}': f'value {key} & more' for key in range(9)}
+            for num in range(elements // 10)}
+
+
+def make_lists(elements: int) -> dict:
+    """
+    Build a dictionary of lists of records.
+
+    :param elements: The approximate number of elements.
+    :return: The dictionary.
+    """
+    return {f'list{num}': [{'id': item, 'name': f'name{item}'} for item in range(33)]
+            for num in range(elements // 100)}
+
+
+def make_deep(elements: int) -> dict:
+    """
+    Build a dictionary nested one level for each element.
+
+    :param elements: The number of nested levels.
+    :return: The dictionary.
+    """
+    root = node = {}
+    for num in range(elements):
+        node['value'] = num
+        node['nested'] = node = {}
+    return root
+
+
+def etree_xml(dict_val: dict) -> bytes:
+    """
+    Convert a dictionary to XML by building an element tree, for comparison.
+
+    :param dict_val: The dictionary to convert, it must not have lists.
+    :return: The XML.
+    """
+    root = ET.Element('root')
+    stack = [(root, dict_val)]
+    while stack:
+        elem, value = stack.pop()
+        for key, item in value.items():
+            child = ET.SubElement(elem, key)
+            if isinstance(item, dict):
+                stack.append((child, item))
+            else:
+                child.text = str(item)
+    return ET.tostring(root)
+
+
+def bench(convert, dict_val: dict) -> tuple:
+    """
+    Measure the time to convert a dictionary to XML.
+
+    :param convert: The function converting the dictionary to bytes.
+    :param dict_val: The dictionary.
+    :return: The size in bytes and the time in seconds.
+    """
+    start = time.perf_counter()
+    xml = convert(dict_val)
+    return len(xml), time.perf_counter() - start
+
+
+def main() -> None:
+    """
+    Print the conversion time and throughput for 10k to 1M element dictionaries.
+
+    :return: None.
+    """
+    shapes = {'wide': make_wide, 'lists': make_lists, 'deep': make_deep}
+    for elements in (10_000, 100_000, 1_000_000):
+        for name, make in shapes.items():
+            dict_val = make(elements)
+            size, seconds = bench(dict_to_xml_string, dict_val)
+            line = (f"{elements:>9} elements, {name:<5}: {size / 1e6:7.1f} MB "
+                    f"in {seconds:.3f} s, {size / 1e6 / seconds:5.1f} MB/s")
+            if name == 'wide':
+                _, tree_seconds = bench(etree_xml, dict_val)
+                line += f", element tree {tree_seconds:.3f} s"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
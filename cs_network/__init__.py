@@ -2,7 +2,18 @@
 __version__ = "1.0.1"
 from .functions import data_config, network_config, data_input, validate_empty_value
 from .functions import continue_input, dict_to_xml_string, server_config
-from .client import initialize_client, input_data, process_data
+from .functions import send_message, recv_exact, recv_message, send_message_stream
+from .functions import send_messages, recv_into_file
+from .sizing import SizeEstimator
+from .segment_log import SegmentLog, iter_log
+from .metrics import LatencyStats, StageTimer
+from .client import initialize_client, input_data, process_data, update_session
 from .client import wait_for_response, send_with_retry, start_client
+from .client import read_chunks, send_encrypted_file, prepare_config, send_session_message
+from .client import send_pipelined, process_batch, Client, send_file
 from .server import initialize_server, receive_config, receive_data, send_response, print_dict
 from .server import start_server, get_private_key, print_to_terminal, process_recv_data
+from .server import handle_connection, serve_client, serve_forever, start_concurrent_server
+from .server import get_session_key, cache_config, process_message, Pipeline, output_batch
+from .server import parse_args, run_daemon, write_output, receive_file, create_output_file
+from .aio import async_start_server, async_send_messages, start_async_server
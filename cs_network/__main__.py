@@ -0,0 +1,8 @@
+"""Run the server with python -m cs_network, headless when options are given."""
+import sys
+from cs_network.server import parse_args, run_daemon, start_server
+
+if len(sys.argv) > 1:
+    run_daemon(parse_args())
+else:
+    start_server()
@@ -0,0 +1,415 @@
+"""Asyncio server and client functions for the network."""
+import asyncio
+import json
+import sys
+from typing import Callable, Union
+from os.path import dirname, join, abspath
+import rsa
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from cs_network import network_config, server_config, get_private_key
+from cs_network import process_data, process_message, update_session
+from cs_network import cache_config, prepare_config, create_output_file, print_to_terminal
+from cs_network.functions import HEADER, MAX_MESSAGE_SIZE, MAX_CONFIG_SIZE, FILE_BUFFER_SIZE
+from cs_network.metrics import StageTimer, NULL_TIMER
+from encryption import DecryptContext
+
+
+async def async_recv_message(reader: asyncio.StreamReader,
+                             max_size: int = MAX_MESSAGE_SIZE,
+                             on_header: Union[Callable[[], object], None] = None) -> bytes:
+    """
+    Receive a whole length-prefixed message from a stream.
+
+    :param reader: The stream to receive from.
+    :param max_size: The maximum size of the message.
+    :param on_header: Called once the length prefix is received, such as the start of a timer.
+    :return: The message.
+    """
+    try:
+        size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if on_header is not None:
+            on_header()
+        if size > max_size:
+            raise ConnectionError(f"Message of {size} bytes exceeds {max_size} bytes.")
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as error:
+        raise ConnectionError("Connection closed by the peer.") from error
+
+
+async def async_receive_config(reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter,
+                               retry: int = 3,
+                               sleep: int = 1,
+                               configs: Union[dict, None] = None,
+                               timer: StageTimer = NULL_TIMER) -> Union[dict, None]:
+    """
+    Receive config from a client stream.
+
+    :param reader: The stream to receive the config from.
+    :param writer: The stream to send the response to.
+    :param retry: The number of times to retry receiving the config.
+    :param sleep: The number of seconds to sleep between retries.
+    :param configs: The cached configs of the connection, by config id.
+    :param timer: The timer of the message stages, started once the config starts to arrive.
+    :return: The dictionary of config, or None if the client ended the config session.
+    """
+    for i in range(1, retry+1):
+        recv_data = await async_recv_message(reader, MAX_CONFIG_SIZE, timer.start)
+        try:
+            recv_data = json.loads(recv_data)
+            if configs is not None and isinstance(recv_data, int):
+                return None
+            if configs is not None and isinstance(recv_data, dict) and 'config_id' in recv_data:
+                if 'type' not in recv_data:
+                    # Unknown config ids are returned as is and rejected with the data,
+                    # the fields of the reference, like the sequence number, are kept
+                    return configs.get(recv_data['config_id'], {}) | recv_data
+                cache_config(recv_data, configs)
+            await async_send_response(writer, 'CONFIG_OK')
+            return recv_data
+        except json.decoder.JSONDecodeError:
+            print("Could not decode the data.\nPlease check the data.")
+            await async_send_response(writer, 'CONFIG_ERROR: JSONDecodeError')
+        print(f"Receive config error. Retry {i} of {repr(retry)}")
+        await asyncio.sleep(sleep)
+    raise ConnectionError("Could not receive the configuration.")
+
+
+async def async_receive_data(reader: asyncio.StreamReader) -> bytes:
+    """
+    Receive data from a client stream.
+
+    :param reader: The stream to receive data from.
+    :return: The data.
+    """
+    return await async_recv_message(reader)
+
+
+async def async_receive_file(reader: asyncio.StreamReader,
+                             config_dict: dict,
+                             serv_conf: dict) -> str:
+    """
+    Receive a file sent as it is, writing each chunk in the default executor.
+
+    :param reader: The stream to receive the file from.
+    :param config_dict: The dictionary of config, with the filename and size.
+    :param serv_conf: The server configuration.
+    :return: The status message.
+    """
+    loop = asyncio.get_running_loop()
+    size = config_dict.get('size')
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        # The end of the file cannot be found without its size
+        raise ConnectionError("Invalid file size.")
+    filename = str(config_dict.get('filename', ''))
+    status = 'DATA_OK'
+    out_file = filepath = None
+    if serv_conf['output_method'] == 1:
+        try:
+            out_file, filepath = await loop.run_in_executor(
+                None, create_output_file, serv_conf, filename)
+        except OSError:
+            status = 'DATA_ERROR: Could not write to file.'
+    try:
+        remaining = size
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, FILE_BUFFER_SIZE))
+            if not chunk:
+                raise ConnectionError("Connection closed by the peer.")
+            remaining -= len(chunk)
+            # The rest of the file is still received after a write error
+            if out_file is not None and status == 'DATA_OK':
+                try:
+                    await loop.run_in_executor(None, out_file.write, chunk)
+                except OSError:
+                    status = 'DATA_ERROR: Could not write to file.'
+    finally:
+        if out_file is not None:
+            out_file.close()
+    if status == 'DATA_OK' and filepath is not None:
+        print_to_terminal(f"{size} bytes written to {filepath}")
+    elif status == 'DATA_OK':
+        print_to_terminal(f"Received {filename} of {size} bytes")
+    return status
+
+
+async def async_send_response(writer: asyncio.StreamWriter,
+                              response: str,
+                              retry: int = 3,
+                              sleep: int = 1) -> None:
+    """
+    Send a response to a client stream.
+
+    :param writer: The stream to send the response to.
+    :param response: The response to send.
+    :param retry: The number of times to retry sending the response.
+    :param sleep: The number of seconds to sleep between retries.
+    :return: None.
+    """
+    await async_send_with_retry(writer, response.encode('utf-8'), retry=retry, sleep=sleep)
+
+
+async def async_send_with_retry(writer: asyncio.StreamWriter,
+                                bytes_to_send: bytes,
+                                retry: int = 3,
+                                sleep: int = 1) -> None:
+    """
+    Send the data with retry, sleeping without blocking the event loop.
+
+    :param writer: The stream to send the data to.
+    :param bytes_to_send: The data to send.
+    :param retry: The number of times to retry the send.
+    :param sleep: The number of seconds to sleep between retries.
+    :return: None.
+    """
+    for i in range(retry):
+        try:
+            writer.write(HEADER.pack(len(bytes_to_send)))
+            writer.write(bytes_to_send)
+            await writer.drain()
+            return None
+        except ConnectionResetError:
+            print(
+                f"Connection Error, retrying in {sleep} second.\nRetry {i+1} of {retry}")
+            await asyncio.sleep(sleep)
+    raise ConnectionError("Could not send the data.")
+
+
+async def async_wait_for_response(reader: asyncio.StreamReader,
+                                  timeout: int = 100) -> bytes:
+    """
+    Wait for the response.
+
+    :param reader: The stream to receive the response from.
+    :param timeout: The timeout.
+    :return: The response.
+    """
+    return await asyncio.wait_for(async_recv_message(reader), timeout)
+
+
+async def handle_client(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter,
+                        serv_conf: dict,
+                        key: rsa.PrivateKey,
+                        window: int = 64) -> None:
+    """
+    Serve a single client stream until the client stops.
+
+    Processing the data decrypts and deserializes it, so it runs in the
+    default executor to keep the event loop free for other clients.
+    Pipelined messages are processed concurrently and acknowledged
+    by sequence number.
+
+    :param reader: The stream to receive from.
+    :param writer: The stream to send to.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param window: The maximum number of pipelined messages in flight.
+    :return: None.
+    """
+    loop = asyncio.get_running_loop()
+    print('Connected by', writer.get_extra_info('peername'))
+    # Session keys are decrypted once and reused for the whole connection
+    sessions = {}
+    # Configs of config sessions, so later messages only send the config id
+    configs = {}
+    # Pipelined messages being processed, receiving waits above the window
+    pending = set()
+    slots = asyncio.Semaphore(window)
+    # The stages of the messages are only timed with latency statistics
+    stats = serv_conf.get('stats')
+
+    async def acknowledge(config: dict, data: bytes, timer: StageTimer) -> None:
+        try:
+            timer.lap('queue')
+            status_msg = await loop.run_in_executor(
+                None, process_message, config, data, serv_conf, key, sessions, None, timer)
+            await async_send_response(
+                writer, json.dumps({'seq': config['seq'], 'status': status_msg}))
+            timer.lap('send')
+            timer.finish(config)
+        except Exception as error:
+            # The client waits for every acknowledgement, so it is stopped instead of hanging
+            print(f"Could not acknowledge message {config['seq']}: {error!r}")
+            writer.close()
+        finally:
+            slots.release()
+
+    try:
+        cont = 1
+        while cont > 0:
+            timer = stats.timer() if stats is not None else NULL_TIMER
+            # Get client configuration
+            config = await async_receive_config(reader, writer, configs=configs, timer=timer)
+            if config is None:
+                break
+            timer.lap('recv_config')
+            if config.get('type') == 3:
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
+                # Files are received straight into their output file
+                status_msg = await async_receive_file(reader, config, serv_conf)
+                timer.lap('recv_file')
+                await async_send_response(writer, status_msg)
+                timer.lap('send')
+                timer.finish(config)
+                if 'config_id' not in config:
+                    cont = int((await async_receive_data(reader)).decode('utf-8'))
+                continue
+            # Get client data
+            data = await async_receive_data(reader)
+            timer.lap('recv_data')
+            if 'seq' in config:
+                # Pipelined messages are acknowledged by sequence number when processed
+                await slots.acquire()
+                task = asyncio.create_task(acknowledge(config, data, timer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if 'session_key' in config:
+                    # The next messages of the session need the key this one opens
+                    await asyncio.wait({task})
+                continue
+            if pending:
+                # Lock-step responses are only sent when no acknowledgement is pending
+                await asyncio.gather(*pending, return_exceptions=True)
+                timer.lap('queue')
+            # Process data
+            status_msg = await loop.run_in_executor(
+                None, process_message, config, data, serv_conf, key, sessions, None, timer)
+            # Send status message
+            await async_send_response(writer, status_msg)
+            timer.lap('send')
+            timer.finish(config)
+            # Check if the client wants to continue, config sessions continue until ended
+            if 'config_id' not in config:
+                cont = int((await async_receive_data(reader)).decode('utf-8'))
+    except (ConnectionError, ValueError):
+        print("Connection Error.")
+    finally:
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        writer.close()
+
+
+async def async_start_server(host: str,
+                             port: int,
+                             serv_conf: dict,
+                             key: rsa.PrivateKey,
+                             backlog: int = 100) -> asyncio.AbstractServer:
+    """
+    Start an asyncio server serving every client on the event loop.
+
+    :param host: The host to bind to.
+    :param port: The port to bind to.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param backlog: The backlog of the socket.
+    :return: The started server.
+    """
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(reader, writer, serv_conf, key),
+        host, port, backlog=backlog)
+    print(f"Listening on {host}:{port}")
+    return server
+
+
+async def async_send_session_message(reader: asyncio.StreamReader,
+                                     writer: asyncio.StreamWriter,
+                                     send_config: dict,
+                                     encoded_data: bytes,
+                                     config_cache: dict,
+                                     timeout: int = 100) -> str:
+    """
+    Send a message in a config session.
+
+    When the config is unchanged, the config id and the data are sent together,
+    and the message takes one round trip instead of three.
+
+    :param reader: The stream to receive the responses from.
+    :param writer: The stream to send the message to.
+    :param send_config: The processed config of the message.
+    :param encoded_data: The processed data of the message.
+    :param config_cache: The config of the config session, updated in place.
+    :param timeout: The timeout for each response.
+    :return: The response from the server.
+    """
+    config, is_reference = prepare_config(send_config, config_cache)
+    config_bytes = json.dumps(config).encode('utf-8')
+    if is_reference:
+        writer.write(HEADER.pack(len(config_bytes)) + config_bytes)
+        await async_send_with_retry(writer, encoded_data)
+    else:
+        await async_send_with_retry(writer, config_bytes)
+        res = await async_wait_for_response(reader, timeout=timeout)
+        if res.decode('utf-8') != "CONFIG_OK":
+            config_cache.clear()
+            return res.decode('utf-8')
+        await async_send_with_retry(writer, encoded_data)
+    return (await async_wait_for_response(reader, timeout=timeout)).decode('utf-8')
+
+
+async def async_send_messages(host: str,
+                              port: int,
+                              messages: list,
+                              timeout: int = 100) -> list:
+    """
+    Send messages over one connection, in one config session.
+
+    :param host: The host to connect to.
+    :param port: The port to connect to.
+    :param messages: The list of (config, data) tuples to send.
+    :param timeout: The timeout for each response.
+    :return: The list of status messages from the server.
+    """
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection(host, port)
+    statuses = []
+    session = None
+    config_cache = {}
+    try:
+        for config, data in messages:
+            # Encryption is done in the default executor
+            session = update_session(session, config)
+            send_config, encoded_data = await loop.run_in_executor(
+                None, process_data, config, data, session)
+            res = await async_send_session_message(
+                reader, writer, send_config, encoded_data, config_cache, timeout=timeout)
+            statuses.append(res)
+            if res.startswith('CONFIG_ERROR'):
+                break
+        # End the config session
+        await async_send_with_retry(writer, b'0')
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return statuses
+
+
+def start_async_server(backlog: int = 100) -> None:
+    """
+    Start the asyncio server and serve clients until interrupted.
+
+    :param backlog: The backlog of the socket.
+    :return: None.
+    """
+    host, port = network_config()
+    serv_conf = server_config()
+    key = get_private_key()
+    if key != '':
+        # Precompute the private key values once for the lifetime of the server
+        key = DecryptContext(key)
+
+    async def run() -> None:
+        server = await async_start_server(host, port, serv_conf, key, backlog=backlog)
+        print("------------Start Connection------------")
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    print("Server closed.")
+
+
+if __name__ == "__main__":
+    start_async_server()
@@ -0,0 +1,284 @@
+"""MessagePack compatible binary serialization of dictionaries."""
+import struct
+from typing import Union
+
+# Limit of nested containers, so malicious data cannot exhaust the stack
+MAX_DEPTH = 512
+
+UINT8 = struct.Struct('>B')
+UINT16 = struct.Struct('>H')
+UINT32 = struct.Struct('>I')
+UINT64 = struct.Struct('>Q')
+INT8 = struct.Struct('>b')
+INT16 = struct.Struct('>h')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+FLOAT32 = struct.Struct('>f')
+FLOAT64 = struct.Struct('>d')
+
+
+def pack_header(buffer: bytearray, size: int, fix: int, codes: tuple) -> None:
+    """
+    Append the header of a string, binary, array or map of a given size.
+
+    :param buffer: The buffer to append to.
+    :param size: The size of the value.
+    :param fix: The first byte of the fix format, or None if there is no fix format.
+    :param codes: The first bytes of the 8, 16 and 32 bit formats, None if there is no format.
+    :return: None.
+    """
+    if fix is not None and size < (32 if fix == 0xa0 else 16):
+        buffer.append(fix | size)
+    elif codes[0] is not None and size <= 0xff:
+        buffer.append(codes[0])
+        buffer.append(size)
+    elif size <= 0xffff:
+        buffer.append(codes[1])
+        buffer += UINT16.pack(size)
+    elif size <= 0xffffffff:
+        buffer.append(codes[2])
+        buffer += UINT32.pack(size)
+    else:
+        raise ValueError(f"Value of {size} items is too large to serialize.")
+
+
+def pack_int(buffer: bytearray, value: int) -> None:
+    """
+    Append an integer in its smallest format.
+
+    :param buffer: The buffer to append to.
+    :param value: The integer.
+    :return: None.
+    """
+    if 0 <= value <= 0x7f or -32 <= value < 0:
+        buffer += INT8.pack(value)
+    elif 0 < value <= 0xff:
+        buffer.append(0xcc)
+        buffer.append(value)
+    elif 0 < value <= 0xffff:
+        buffer.append(0xcd)
+        buffer += UINT16.pack(value)
+    elif 0 < value <= 0xffffffff:
+        buffer.append(0xce)
+        buffer += UINT32.pack(value)
+    elif 0 < value <= 0xffffffffffffffff:
+        buffer.append(0xcf)
+        buffer += UINT64.pack(value)
+    elif -0x80 <= value < 0:
+        buffer.append(0xd0)
+        buffer += INT8.pack(value)
+    elif -0x8000 <= value < 0:
+        buffer.append(0xd1)
+        buffer += INT16.pack(value)
+    elif -0x80000000 <= value < 0:
+        buffer.append(0xd2)
+        buffer += INT32.pack(value)
+    elif -0x8000000000000000 <= value < 0:
+        buffer.append(0xd3)
+        buffer += INT64.pack(value)
+    else:
+        raise ValueError(f"Integer {value} is too large to serialize.")
+
+
+def pack_into(buffer: bytearray, value: object, depth: int = 0) -> None:
+    """
+    Append a value to a buffer.
+
+    :param buffer: The buffer to append to.
+    :param value: The value, a dictionary, list, tuple, string, bytes, number, bool or None.
+    :param depth: The depth of the value in the nested containers.
+    :return: None.
+    """
+    if depth > MAX_DEPTH:
+        raise ValueError("Value is nested too deeply to serialize.")
+    if isinstance(value, str):
+        encoded = value.encode('utf-8')
+        pack_header(buffer, len(encoded), 0xa0, (0xd9, 0xda, 0xdb))
+        buffer += encoded
+    elif isinstance(value, dict):
+        pack_header(buffer, len(value), 0x80, (None, 0xde, 0xdf))
+        for key, item in value.items():
+            # Short strings, the most common keys and values, are packed inline
+            if type(key) is str and len(key) < 8:
+                encoded = key.encode('utf-8')
+                buffer.append(0xa0 | len(encoded))
+                buffer += encoded
+            else:
+                pack_into(buffer, key, depth + 1)
+            if type(item) is str and len(item) < 8:
+                encoded = item.encode('utf-8')
+                buffer.append(0xa0 | len(encoded))
+                buffer += encoded
+            else:
+                pack_into(buffer, item, depth + 1)
+    elif value is None:
+        buffer.append(0xc0)
+    elif value is True:
+        buffer.append(0xc3)
+    elif value is False:
+        buffer.append(0xc2)
+    elif isinstance(value, int):
+        pack_int(buffer, value)
+    elif isinstance(value, float):
+        buffer.append(0xcb)
+        buffer += FLOAT64.pack(value)
+    elif isinstance(value, (list, tuple)):
+        pack_header(buffer, len(value), 0x90, (None, 0xdc, 0xdd))
+        for item in value:
+            pack_into(buffer, item, depth + 1)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        pack_header(buffer, len(value), None, (0xc4, 0xc5, 0xc6))
+        buffer += value
+    else:
+        raise TypeError(f"Cannot serialize {type(value).__name__}.")
+
+
+def packb(value: object) -> bytes:
+    """
+    Serialize a value to MessagePack.
+
+    :param value: The value, a dictionary, list, tuple, string, bytes, number, bool or None.
+    :return: The serialized value.
+    """
+    buffer = bytearray()
+    pack_into(buffer, value)
+    return bytes(buffer)
+
+
+def read(data: bytes, offset: int, size: int) -> tuple:
+    """
+    Read a number of bytes.
+
+    :param data: The serialized data.
+    :param offset: The offset to read from.
+    :param size: The number of bytes to read.
+    :return: The bytes and the offset after them.
+    """
+    end = offset + size
+    if end > len(data):
+        raise ValueError("Truncated MessagePack data.")
+    return data[offset:end], end
+
+
+def read_struct(data: bytes, offset: int, fmt: struct.Struct) -> tuple:
+    """
+    Read a number with a struct format.
+
+    :param data: The serialized data.
+    :param offset: The offset to read from.
+    :param fmt: The struct format of the number.
+    :return: The number and the offset after it.
+    """
+    if offset + fmt.size > len(data):
+        raise ValueError("Truncated MessagePack data.")
+    return fmt.unpack_from(data, offset)[0], offset + fmt.size
+
+
+# Struct formats of the numbers, and of the sizes of strings, binaries, arrays and maps
+NUMBERS = {0xca: FLOAT32, 0xcb: FLOAT64, 0xcc: UINT8, 0xcd: UINT16, 0xce: UINT32, 0xcf: UINT64,
+           0xd0: INT8, 0xd1: INT16, 0xd2: INT32, 0xd3: INT64}
+STRINGS = {0xd9: UINT8, 0xda: UINT16, 0xdb: UINT32}
+BINARIES = {0xc4: UINT8, 0xc5: UINT16, 0xc6: UINT32}
+ARRAYS = {0xdc: UINT16, 0xdd: UINT32}
+MAPS = {0xde: UINT16, 0xdf: UINT32}
+
+
+def unpack_from(data: bytes, offset: int = 0, depth: int = 0) -> tuple:
+    """
+    Deserialize the value at an offset.
+
+    Only plain values are created, so untrusted data cannot run code.
+
+    :param data: The serialized data.
+    :param offset: The offset of the value.
+    :param depth: The depth of the value in the nested containers.
+    :return: The value and the offset after it.
+    """
+    if depth > MAX_DEPTH:
+        raise ValueError("MessagePack data is nested too deeply.")
+    if offset >= len(data):
+        raise ValueError("Truncated MessagePack data.")
+    code = data[offset]
+    offset += 1
+    if code <= 0x7f:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if 0xa0 <= code <= 0xbf or code in STRINGS:
+        size = code & 0x1f if code <= 0xbf else None
+        if size is None:
+            size, offset = read_struct(data, offset, STRINGS[code])
+        raw, offset = read(data, offset, size)
+        try:
+            return raw.decode('utf-8'), offset
+        except UnicodeDecodeError as error:
+            raise ValueError("Invalid string in MessagePack data.") from error
+    if code <= 0x8f or code in MAPS:
+        if code <= 0x8f:
+            size = code & 0x0f
+        else:
+            size, offset = read_struct(data, offset, MAPS[code])
+        result = {}
+        length = len(data)
+        for _ in range(size):
+            # Short strings, the most common keys and values, are read inline
+            code = data[offset] if offset < length else 0
+            if 0xa0 <= code <= 0xbf:
+                end = offset + 1 + (code & 0x1f)
+                if end > length:
+                    raise ValueError("Truncated MessagePack data.")
+                key = data[offset + 1:end].decode('utf-8')
+                offset = end
+            else:
+                key, offset = unpack_from(data, offset, depth + 1)
+            code = data[offset] if offset < length else 0
+            if 0xa0 <= code <= 0xbf:
+                end = offset + 1 + (code & 0x1f)
+                if end > length:
+                    raise ValueError("Truncated MessagePack data.")
+                value = data[offset + 1:end].decode('utf-8')
+                offset = end
+            else:
+                value, offset = unpack_from(data, offset, depth + 1)
+            try:
+                result[key] = value
+            except TypeError as error:
+                raise ValueError("Unhashable key in MessagePack data.") from error
+        return result, offset
+    if code <= 0x9f or code in ARRAYS:
+        if code <= 0x9f:
+            size = code & 0x0f
+        else:
+            size, offset = read_struct(data, offset, ARRAYS[code])
+        result = []
+        for _ in range(size):
+            value, offset = unpack_from(data, offset, depth + 1)
+            result.append(value)
+        return result, offset
+    if code in NUMBERS:
+        return read_struct(data, offset, NUMBERS[code])
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    if code in BINARIES:
+        size, offset = read_struct(data, offset, BINARIES[code])
+        return read(data, offset, size)
+    raise ValueError(f"Unsupported MessagePack type 0x{code:02x}.")
+
+
+def unpackb(data: Union[bytes, bytearray, memoryview]) -> object:
+    """
+    Deserialize MessagePack data.
+
+    :param data: The serialized data.
+    :return: The value.
+    """
+    data = bytes(data)
+    value, offset = unpack_from(data)
+    if offset != len(data):
+        raise ValueError("Extra data after the MessagePack value.")
+    return value
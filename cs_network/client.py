@@ -4,14 +4,21 @@ import json
 import sys
 import pickle
 import time
+import uuid
 import base64
-from typing import Union
-from os.path import dirname, join, abspath
+from itertools import islice, groupby
+from typing import Union, Iterable, Iterator
+from os.path import dirname, join, abspath, getsize, basename
 import rsa
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
 from cs_network import validate_empty_value, continue_input, dict_to_xml_string
 from cs_network import data_config, network_config, data_input
-from encryption import encrypt, EXAMPLE_PUB_KEY
+from cs_network import send_message, recv_message, send_message_stream, send_messages
+from cs_network.binary import packb
+from cs_network.compression import compress, METHODS
+from encryption import encrypt, hybrid_encrypt, max_message_size
+from encryption import new_session, symmetric_encrypt
+from encryption import encrypt_stream, encrypted_stream_size, get_example_pub_key
 
 
 def initialize_client(host: str, port: int) -> socket.socket:
@@ -36,8 +43,8 @@ def input_data(configuration_dict: dict,
                data_dictionary: dict,
                start_from: int = 1,
                retry: int = 3,
-               max_bytes: int = 245,
-               example_p_key: rsa.PublicKey = EXAMPLE_PUB_KEY,
+               max_bytes: int = 1048576,
+               example_p_key: Union[rsa.PublicKey, None] = None,
                ) -> tuple:
     """
     Input the data.
@@ -47,7 +54,7 @@ def input_data(configuration_dict: dict,
     :param start_from: The starting point of the data.
     :param retry: The number of times to retry the input.
     :param max_bytes: The maximum number of bytes for data.
-    :param example_p_key: The example public key.
+    :param example_p_key: The example public key, defaults to the example public key.
     :return: The tuple of dictionaries.
     """
     if start_from <= 1:
@@ -65,12 +72,46 @@ def input_data(configuration_dict: dict,
     return configuration_dict, data_dictionary
 
 
-def process_data(config_dict: dict, data: Union[str, dict]) -> tuple:
+def update_session(session: Union[dict, None], config_dict: dict) -> Union[dict, None]:
+    """
+    Get the session for the configuration.
+
+    A new session is created when encryption is turned on,
+    or when the public key changes.
+
+    :param session: The current session.
+    :param config_dict: The user's configuration data.
+    :return: The session to use, or None if encryption is off.
+    """
+    if config_dict['encrypt'] != 1:
+        return session
+    if session is None or session['public_key'] != config_dict['public_key']:
+        session = new_session(config_dict['public_key'])
+    return session
+
+
+def compress_payload(config_dict: dict, data: bytes) -> bytes:
+    """
+    Compress a payload with the compression method of the config, if any.
+
+    :param config_dict: The config, with the 'compress' method and optional 'compress_level'.
+    :param data: The payload.
+    :return: The payload with its compression flag, or the payload as is without compression.
+    """
+    if not config_dict.get('compress'):
+        return data
+    return compress(data, config_dict['compress'], config_dict.get('compress_level'))
+
+
+def process_data(config_dict: dict,
+                 data: Union[str, dict],
+                 session: Union[dict, None] = None) -> tuple:
     """
     Process the data.
 
     :config_dict: The user's configuration data.
     :data: The user's data.
+    :session: The session from update_session, to encrypt with the session key.
     :return: The processed data.
     """
 
@@ -78,7 +119,23 @@ def process_data(config_dict: dict, data: Union[str, dict]) -> tuple:
     time_txt = time.strftime("%Y%m%d_%H%M%S", time.localtime())
 
     if output_dict['encrypt'] == 1:
-        output_dict['data'] = encrypt(str(data), output_dict.pop('public_key'))
+        # The message is compressed before it is encrypted, as encrypted data does not compress
+        message = compress_payload(output_dict, str(data).encode('utf-8'))
+        public_key = output_dict.pop('public_key')
+        if session is not None:
+            output_dict['data'] = symmetric_encrypt(message, session['key'])
+            output_dict['cipher'] = 'session'
+            output_dict['session_id'] = session['id']
+            if 'wrapped_key' in session:
+                # The encrypted session key is only sent with the first message
+                output_dict['session_key'] = base64.b64encode(
+                    session.pop('wrapped_key')).decode('utf-8')
+        # Messages larger than one RSA block are encrypted with a session key
+        elif len(message) <= max_message_size(public_key):
+            output_dict['data'] = encrypt(message, public_key)
+        else:
+            output_dict['data'] = hybrid_encrypt(message, public_key)
+            output_dict['cipher'] = 'hybrid'
 
     if output_dict['type'] == 2 and output_dict['encrypt'] == 1:
         textdata = base64.b64encode(output_dict['data']).decode('utf-8')
@@ -86,9 +143,10 @@ def process_data(config_dict: dict, data: Union[str, dict]) -> tuple:
         textdata = data
 
     if output_dict['type'] == 2:
-        if output_dict['txtfilepath'] is None:
+        # Configs without a txtfilepath, like those of Client, do not save the text
+        if output_dict.get('txtfilepath', False) is None:
             print("Invalid file path specified. File will not be saved.")
-        else:
+        elif 'txtfilepath' in output_dict:
             with open(f"{output_dict['txtfilepath']}_{time_txt}.txt", 'w',
                       encoding='utf-8') as file:
                 file.write(str(textdata))
@@ -106,24 +164,58 @@ def process_data(config_dict: dict, data: Union[str, dict]) -> tuple:
         output_dict['data'] = json.dumps(data).encode('utf-8')
     elif output_dict['serialize'] == 3 and output_dict['encrypt'] == 2:
         output_dict['data'] = dict_to_xml_string(data)
+    elif output_dict['serialize'] == 4 and output_dict['encrypt'] == 2:
+        output_dict['data'] = packb(data)
+
+    if output_dict['encrypt'] == 2:
+        output_dict['data'] = compress_payload(output_dict, output_dict['data'])
 
     data_only = output_dict.pop('data')
 
     return output_dict, data_only
 
 
-def wait_for_response(sock: socket.socket, timeout: int = 100, socksize: int = 1024) -> str:
+def process_batch(config_dict: dict,
+                  records: Iterable[Union[str, dict]],
+                  session: Union[dict, None] = None) -> tuple:
+    """
+    Process many records into the payload of one message.
+
+    The records are serialized and encrypted together as one list, so the
+    server validates the config, decrypts and writes the output once per batch.
+    XML documents are wrapped in a batch element, and plain texts are sent
+    as a JSON list.
+
+    :config_dict: The user's configuration data.
+    :records: The dictionaries or texts to send.
+    :session: The session from update_session, to encrypt with the session key.
+    :return: The processed config and data of the batch.
+    """
+    records = list(records)
+    if config_dict['type'] == 1 and config_dict['encrypt'] == 2 and config_dict['serialize'] == 3:
+        # The XML documents of the records are wrapped in one batch document
+        output_dict, _ = process_data(config_dict, {}, session)
+        data_only = compress_payload(output_dict, b''.join(
+            [b'<batch>', *map(dict_to_xml_string, records), b'</batch>']))
+    elif config_dict['type'] == 2 and config_dict['encrypt'] == 2:
+        output_dict, data_only = process_data(config_dict, json.dumps(records), session)
+    else:
+        output_dict, data_only = process_data(config_dict, records, session)
+    output_dict['batch'] = True
+    return output_dict, data_only
+
+
+def wait_for_response(sock: socket.socket, timeout: int = 100) -> bytes:
     """
     Wait for the response.
 
     :param sock: The client socket.
     :param timeout: The timeout.
-    :param socksize: The socket size.
     :return: The response.
     """
     sock.settimeout(timeout)
     try:
-        response = sock.recv(socksize)
+        response = recv_message(sock)
     except socket.timeout:
         print("Connection timed out.\nPlease try again.\nCheck the host and port.")
         sys.exit(1)
@@ -145,7 +237,7 @@ def send_with_retry(sock: socket.socket,
     """
     for i in range(retry):
         try:
-            sock.sendall(bytes_to_send)
+            send_message(sock, bytes_to_send)
             break
         except ConnectionResetError:
             # retry after a second
@@ -154,6 +246,341 @@ def send_with_retry(sock: socket.socket,
             time.sleep(sleep)
 
 
+def prepare_config(send_config: dict, config_cache: dict) -> tuple:
+    """
+    Prepare the config of a message in a config session.
+
+    A config that differs from the previous one is sent in full with a new
+    config id, and the server caches it. Otherwise only the config id is sent.
+
+    :param send_config: The processed config of the message.
+    :param config_cache: The config of the config session, updated in place.
+    :return: The config to send, and True if it is only the config id.
+    """
+    # The encrypted session key is only sent with the first message
+    config = {key: value for key, value in send_config.items() if key != 'session_key'}
+    if config_cache.get('config') == config:
+        return {'config_id': config_cache['config_id']}, True
+    config_cache['config'] = config
+    config_cache['config_id'] = uuid.uuid4().hex
+    return send_config | {'config_id': config_cache['config_id']}, False
+
+
+def send_session_message(sock: socket.socket,
+                         send_config: dict,
+                         encoded_data: bytes,
+                         config_cache: dict,
+                         timeout: int = 100) -> str:
+    """
+    Send a message in a config session.
+
+    When the config is unchanged, the config id and the data are sent together,
+    and the message takes one round trip instead of three.
+
+    :param sock: The client socket.
+    :param send_config: The processed config of the message.
+    :param encoded_data: The processed data of the message.
+    :param config_cache: The config of the config session, updated in place.
+    :param timeout: The timeout for each response.
+    :return: The response from the server.
+    """
+    config, is_reference = prepare_config(send_config, config_cache)
+    if is_reference:
+        send_messages(sock, [json.dumps(config).encode('utf-8'), encoded_data])
+    else:
+        send_with_retry(sock, json.dumps(config).encode('utf-8'))
+        res = wait_for_response(sock, timeout=timeout)
+        if res.decode('utf-8') != "CONFIG_OK":
+            config_cache.clear()
+            return res.decode('utf-8')
+        send_with_retry(sock, encoded_data)
+    return wait_for_response(sock, timeout=timeout).decode('utf-8')
+
+
+def send_pipelined(sock: socket.socket,
+                   messages: Iterable[tuple],
+                   config_cache: dict,
+                   window: int = 8,
+                   timeout: int = 100) -> list:
+    """
+    Send messages in a config session without waiting for each response.
+
+    Each message carries a sequence number, and up to window messages are in
+    flight before an acknowledgement is awaited. The server acknowledges each
+    message with {"seq": ..., "status": ...} when it is processed, possibly
+    out of order. A new config is still confirmed with CONFIG_OK first.
+
+    :param sock: The client socket.
+    :param messages: The processed (config, data) tuples to send.
+    :param config_cache: The config of the config session, updated in place.
+    :param window: The maximum number of messages in flight.
+    :param timeout: The timeout for each response.
+    :return: The list of status messages from the server, in the order of the messages.
+    """
+    statuses = {}
+
+    def read_ack() -> None:
+        ack = json.loads(wait_for_response(sock, timeout=timeout))
+        statuses[ack['seq']] = ack['status']
+
+    sent = 0
+    for seq, (send_config, encoded_data) in enumerate(messages):
+        config, is_reference = prepare_config(send_config, config_cache)
+        config_bytes = json.dumps(config | {'seq': seq}).encode('utf-8')
+        sent = seq + 1
+        if is_reference:
+            while seq - len(statuses) >= window:
+                read_ack()
+            send_messages(sock, [config_bytes, encoded_data])
+            continue
+        # The CONFIG_OK response is only sent when no acknowledgement is pending
+        while len(statuses) < seq:
+            read_ack()
+        send_with_retry(sock, config_bytes)
+        res = wait_for_response(sock, timeout=timeout).decode('utf-8')
+        if res != "CONFIG_OK":
+            config_cache.clear()
+            statuses[seq] = res
+            continue
+        send_with_retry(sock, encoded_data)
+    while len(statuses) < sent:
+        read_ack()
+    return [statuses[seq] for seq in range(sent)]
+
+
+def read_chunks(filepath: str, chunk_size: int = 65536) -> Iterator[bytes]:
+    """
+    Read a file in chunks.
+
+    :param filepath: The path of the file to read.
+    :param chunk_size: The size of each chunk.
+    :return: An iterator of chunks.
+    """
+    with open(filepath, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def send_encrypted_file(sock: socket.socket,
+                        filepath: str,
+                        public_key: rsa.PublicKey,
+                        timeout: int = 100) -> str:
+    """
+    Send a text file encrypted block by block, without reading it into memory.
+
+    :param sock: The client socket.
+    :param filepath: The path of the text file to send.
+    :param public_key: The public key to encrypt with.
+    :param timeout: The timeout for each response.
+    :return: The response from the server.
+    """
+    config = {'type': 2, 'encrypt': 1, 'serialize': None, 'cipher': 'stream'}
+    send_with_retry(sock, json.dumps(config).encode('utf-8'))
+    res = wait_for_response(sock, timeout=timeout)
+    if res.decode('utf-8') != "CONFIG_OK":
+        return res.decode('utf-8')
+    send_message_stream(sock,
+                        encrypt_stream(read_chunks(filepath), public_key),
+                        encrypted_stream_size(getsize(filepath), public_key))
+    return wait_for_response(sock, timeout=timeout).decode('utf-8')
+
+
+def send_file(sock: socket.socket,
+              filepath: str,
+              config_cache: Union[dict, None] = None,
+              timeout: int = 100) -> str:
+    """
+    Send a file as it is with socket.sendfile, without reading it into memory.
+
+    The size of the file is sent in the config, and the file follows without
+    a length prefix, so files larger than the maximum message size can be sent.
+
+    :param sock: The client socket.
+    :param filepath: The path of the file to send.
+    :param config_cache: The config of the config session, updated in place,
+        or None to send the file outside a config session.
+    :param timeout: The timeout for each response.
+    :return: The response from the server.
+    """
+    size = getsize(filepath)
+    config = {'type': 3, 'encrypt': 2, 'serialize': None,
+              'filename': basename(filepath), 'size': size}
+    is_reference = False
+    if config_cache is not None:
+        config, is_reference = prepare_config(config, config_cache)
+    send_with_retry(sock, json.dumps(config).encode('utf-8'))
+    if not is_reference:
+        res = wait_for_response(sock, timeout=timeout)
+        if res.decode('utf-8') != "CONFIG_OK":
+            if config_cache is not None:
+                config_cache.clear()
+            return res.decode('utf-8')
+    with open(filepath, 'rb') as file:
+        # The kernel copies the file to the socket where sendfile is supported,
+        # and only the size in the config is sent if the file grows meanwhile
+        sent = sock.sendfile(file, 0, size) if size else 0
+    if sent != size:
+        raise ConnectionError(f"Sent {sent} bytes of {filepath} instead of {size} bytes.")
+    return wait_for_response(sock, timeout=timeout).decode('utf-8')
+
+
+class Client:
+    """
+    Client sending dictionaries and texts from code, without prompts.
+
+    Every message is sent over one connection in a config session,
+    and encrypted messages reuse one session key.
+    """
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 serialize: int = 1,
+                 encrypt: int = 2,
+                 public_key: Union[rsa.PublicKey, None] = None,
+                 timeout: int = 100,
+                 window: int = 8,
+                 compress: Union[str, None] = None,
+                 compress_level: Union[int, None] = None) -> None:
+        """
+        Connect to the server.
+
+        :param host: The host to connect to.
+        :param port: The port to connect to.
+        :param serialize: The serialization of dictionaries,
+            1 for binary, 2 for JSON, 3 for XML, 4 for MessagePack.
+        :param encrypt: 1 to encrypt the messages, 2 to send them in plain.
+        :param public_key: The public key, defaults to the example public key.
+        :param timeout: The timeout for each response.
+        :param window: The maximum number of messages in flight in send_many.
+        :param compress: The compression method, 'zlib', 'lzma' or 'bz2', or None to not compress.
+        :param compress_level: The compression level, defaults to the method's default.
+        """
+        if serialize not in (1, 2, 3, 4):
+            raise ValueError("Invalid serialize type.")
+        if encrypt not in (1, 2):
+            raise ValueError("Invalid encrypt type.")
+        if compress is not None and compress not in METHODS:
+            raise ValueError("Invalid compression method.")
+        # Encrypted dictionaries are serialized to binary, as in data_config
+        self.configs = {
+            1: {'type': 1, 'encrypt': encrypt, 'serialize': 1 if encrypt == 1 else serialize},
+            2: {'type': 2, 'encrypt': encrypt, 'serialize': None},
+        }
+        if encrypt == 1:
+            public_key = public_key or get_example_pub_key()
+            for config in self.configs.values():
+                config['public_key'] = public_key
+        if compress is not None:
+            for config in self.configs.values():
+                config['compress'] = compress
+                if compress_level is not None:
+                    config['compress_level'] = compress_level
+        self.timeout = timeout
+        self.window = window
+        self.session = None
+        self.config_cache = {}
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def config(self, obj: Union[str, dict]) -> dict:
+        """
+        Get the config of a dictionary or a text.
+
+        :param obj: The dictionary or text.
+        :return: The config.
+        """
+        config = self.configs[1 if isinstance(obj, dict) else 2]
+        self.session = update_session(self.session, config)
+        return config
+
+    def process(self, obj: Union[str, dict]) -> tuple:
+        """
+        Process a dictionary or a text into a message.
+
+        :param obj: The dictionary or text.
+        :return: The processed config and data.
+        """
+        return process_data(self.config(obj), obj if isinstance(obj, dict) else str(obj),
+                            self.session)
+
+    def send(self, obj: Union[str, dict]) -> str:
+        """
+        Send a dictionary or a text and wait for the response.
+
+        :param obj: The dictionary or text.
+        :return: The response from the server.
+        """
+        send_config, encoded_data = self.process(obj)
+        return send_session_message(self.sock, send_config, encoded_data, self.config_cache,
+                                    timeout=self.timeout)
+
+    def send_file(self, filepath: str) -> str:
+        """
+        Send a file as it is, without reading it into memory.
+
+        :param filepath: The path of the file.
+        :return: The response from the server.
+        """
+        return send_file(self.sock, filepath, self.config_cache, timeout=self.timeout)
+
+    def batches(self, objs: Iterable[Union[str, dict]], batch_size: int) -> Iterator[list]:
+        """
+        Split dictionaries and texts into batches of the same type.
+
+        :param objs: The dictionaries and texts.
+        :param batch_size: The maximum number of records in each batch.
+        :return: An iterator of batches.
+        """
+        objs = iter(objs)
+        while chunk := list(islice(objs, batch_size)):
+            for is_dict, records in groupby(chunk, key=lambda obj: isinstance(obj, dict)):
+                yield [obj if is_dict else str(obj) for obj in records]
+
+    def send_many(self,
+                  objs: Iterable[Union[str, dict]],
+                  batch_size: Union[int, None] = None) -> list:
+        """
+        Send dictionaries and texts pipelined, optionally in batches.
+
+        :param objs: The dictionaries and texts.
+        :param batch_size: The number of records in each batch, or None to send them one by one.
+        :return: The list of responses from the server, one for each dictionary or text.
+        """
+        if batch_size is None:
+            return send_pipelined(self.sock, map(self.process, objs), self.config_cache,
+                                  window=self.window, timeout=self.timeout)
+        sizes = []
+
+        def process_batches() -> Iterator[tuple]:
+            for records in self.batches(objs, batch_size):
+                sizes.append(len(records))
+                yield process_batch(self.config(records[0]), records, self.session)
+
+        statuses = send_pipelined(self.sock, process_batches(), self.config_cache,
+                                  window=self.window, timeout=self.timeout)
+        return [status for status, size in zip(statuses, sizes) for _ in range(size)]
+
+    def close(self) -> None:
+        """
+        End the config session and close the connection.
+
+        :return: None.
+        """
+        try:
+            send_with_retry(self.sock, b'0')
+        except OSError:
+            # The server already closed the connection
+            pass
+        finally:
+            self.sock.close()
+
+
 def start_client(timeout: Union[int, None] = None) -> None:
     """
     Main function.
@@ -169,35 +596,34 @@ def start_client(timeout: Union[int, None] = None) -> None:
     start = 1
     config = {}
     data_dict = {}
+    session = None
+    config_cache = {}
     while start > 0:
         print("---------Connection Initialized---------")
         if start == 1:
             config, data_dict = input_data(
-                config, data_dict, start_from=start, example_p_key=EXAMPLE_PUB_KEY)
+                config, data_dict, start_from=start)
         elif start == 2:
             data_dict = {}
             _, data_dict = input_data(
-                config, data_dict, start_from=start, example_p_key=EXAMPLE_PUB_KEY)
+                config, data_dict, start_from=start)
         print("---------Processing Data---------")
-        send_config, encoded_data = process_data(config, data_dict)
+        session = update_session(session, config)
+        send_config, encoded_data = process_data(config, data_dict, session)
         print("Processing complete.")
-        print("---------Sending Config---------")
-        send_with_retry(sock, json.dumps(send_config).encode('utf-8'))
-        res = wait_for_response(sock, timeout=100)
-        if res.decode('utf-8') != "CONFIG_OK":
-            print(f"Configuration failed: {res.decode('utf-8')}")
-            sys.exit(1)
-        print(res.decode('utf-8'))
         print("---------Sending Data---------")
-        send_with_retry(sock, encoded_data)
-        res = wait_for_response(sock, timeout=100)
-        if res.decode('utf-8') == "DATA_OK":
+        res = send_session_message(sock, send_config, encoded_data, config_cache)
+        if res.startswith('CONFIG_ERROR'):
+            print(f"Configuration failed: {res}")
+            sys.exit(1)
+        if res == "DATA_OK":
             print("Data processed successfully.")
         else:
-            print(f"Data processing failed: {res.decode('utf-8')}")
+            print(f"Data processing failed: {res}")
         print("--------- Continue? ---------")
         start = continue_input()
-        send_with_retry(sock, str(start).encode('utf-8'))
+    # End the config session
+    send_with_retry(sock, str(start).encode('utf-8'))
     sock.close()
     print("Connection closed.")
 
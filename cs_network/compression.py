@@ -0,0 +1,121 @@
+"""Compression of message payloads with zlib, lzma or bz2."""
+import bz2
+import lzma
+import zlib
+from typing import Iterable, Iterator, Union
+
+METHODS = ('zlib', 'lzma', 'bz2')
+# The first byte of a payload tells if the rest is compressed or stored as is
+STORED = b'\x00'
+COMPRESSED = b'\x01'
+# Payloads smaller than this are stored, as compressing them saves little or nothing
+MIN_COMPRESS_SIZE = 256
+# Number of bytes fed to the compressor at a time
+CHUNK_SIZE = 1 << 20
+
+
+def compressor(method: str, level: Union[int, None] = None):
+    """
+    Create a streaming compressor.
+
+    :param method: The compression method, 'zlib', 'lzma' or 'bz2'.
+    :param level: The compression level, from 0 (1 for bz2) to 9, defaults to the method's default.
+    :return: The compressor, with compress and flush methods.
+    """
+    if method == 'zlib':
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+    if method == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    if method == 'bz2':
+        return bz2.BZ2Compressor(9 if level is None else level)
+    raise ValueError(f"Unsupported compression method {method}.")
+
+
+def decompressor(method: str):
+    """
+    Create a streaming decompressor.
+
+    :param method: The compression method, 'zlib', 'lzma' or 'bz2'.
+    :return: The decompressor, with a decompress method taking a maximum length.
+    """
+    if method == 'zlib':
+        return zlib.decompressobj()
+    if method == 'lzma':
+        return lzma.LZMADecompressor()
+    if method == 'bz2':
+        return bz2.BZ2Decompressor()
+    raise ValueError(f"Unsupported compression method {method}.")
+
+
+def iter_compress(chunks: Iterable[bytes],
+                  method: str,
+                  level: Union[int, None] = None) -> Iterator[bytes]:
+    """
+    Compress a stream of chunks.
+
+    :param chunks: The chunks of data.
+    :param method: The compression method, 'zlib', 'lzma' or 'bz2'.
+    :param level: The compression level.
+    :return: An iterator of compressed chunks.
+    """
+    stream = compressor(method, level)
+    for chunk in chunks:
+        if compressed := stream.compress(chunk):
+            yield compressed
+    yield stream.flush()
+
+
+def compress(data: bytes,
+             method: str,
+             level: Union[int, None] = None,
+             min_size: int = MIN_COMPRESS_SIZE) -> bytes:
+    """
+    Compress a payload, storing it as is when it is small or does not compress.
+
+    :param data: The payload.
+    :param method: The compression method, 'zlib', 'lzma' or 'bz2'.
+    :param level: The compression level.
+    :param min_size: The size below which the payload is stored.
+    :return: The payload with its compression flag.
+    """
+    if len(data) >= min_size:
+        view = memoryview(data)
+        compressed = b''.join(iter_compress(
+            (view[offset:offset + CHUNK_SIZE] for offset in range(0, len(data), CHUNK_SIZE)),
+            method, level))
+        if len(compressed) < len(data):
+            return COMPRESSED + compressed
+    return STORED + data
+
+
+def decompress(data: bytes, method: str, max_size: Union[int, None] = None) -> bytes:
+    """
+    Decompress a payload from compress.
+
+    :param data: The payload with its compression flag.
+    :param method: The compression method, 'zlib', 'lzma' or 'bz2'.
+    :param max_size: The maximum size of the decompressed payload, None for no limit.
+    :return: The decompressed payload.
+    """
+    view = memoryview(data)
+    if view[:1] == STORED:
+        return bytes(view[1:])
+    if view[:1] != COMPRESSED:
+        raise ValueError("Invalid compression flag.")
+    stream = decompressor(method)
+    if max_size is not None:
+        # Reading one byte more than the limit tells if the payload is too large
+        max_length = max_size + 1
+    else:
+        max_length = 0 if method == 'zlib' else -1
+    try:
+        result = stream.decompress(view[1:], max_length)
+    except (zlib.error, lzma.LZMAError, OSError, EOFError) as error:
+        raise ValueError("Invalid compressed data.") from error
+    if max_size is not None and len(result) > max_size:
+        raise ValueError(f"Decompressed data exceeds {max_size} bytes.")
+    if not stream.eof:
+        raise ValueError("Truncated compressed data.")
+    if stream.unused_data:
+        raise ValueError("Extra data after the compressed data.")
+    return result
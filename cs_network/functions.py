@@ -2,76 +2,240 @@
 import socket
 import sys
 import string
-import json
 import time
-import pickle
 import os
-from xml.parsers.expat import ExpatError
-from xml.dom.minidom import parseString
-from xml.etree.ElementTree import Element, tostring
-from typing import Union
+import struct
+import re
+from functools import lru_cache
+from xml.parsers import expat
+from typing import Callable, Union, Iterable
 from ast import literal_eval
 from os.path import dirname, join, abspath, exists, isdir
 import rsa
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
-from encryption import EXAMPLE_PUB_KEY, load_pub_key
+from encryption import get_example_pub_key, load_pub_key_cached
+from cs_network.xmlstream import iter_xml
+from cs_network.sizing import SizeEstimator
+
+# Every message on the wire is a 4-byte big-endian length followed by the payload
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 1 << 30
+# Configs are small JSON objects, so a larger config is rejected before it is received
+MAX_CONFIG_SIZE = 1 << 16
+# The receive buffer starts at this size and doubles as the bytes arrive, so a
+# header alone cannot make the receiver allocate the whole declared size
+INITIAL_BUFFER_SIZE = 1 << 20
+# Payloads smaller than this are joined with their header to be sent in one call
+JOIN_LIMIT = 1 << 16
+# Size of the buffer files are received through
+FILE_BUFFER_SIZE = 1 << 20
+
+
+def send_message(sock: socket.socket, payload: bytes) -> None:
+    """
+    Send a length-prefixed message.
+
+    :param sock: The socket to send the message to.
+    :param payload: The message to send.
+    :return: None.
+    """
+    header = HEADER.pack(len(payload))
+    if len(payload) < JOIN_LIMIT:
+        sock.sendall(header + payload)
+    else:
+        # Avoid copying large payloads just to prepend the header
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+def send_messages(sock: socket.socket, payloads: list) -> None:
+    """
+    Send several length-prefixed messages in one call.
+
+    :param sock: The socket to send the messages to.
+    :param payloads: The messages to send.
+    :return: None.
+    """
+    sock.sendall(b''.join(HEADER.pack(len(payload)) + payload for payload in payloads))
+
+
+def send_message_stream(sock: socket.socket,
+                        chunks: Iterable[bytes],
+                        size: int,
+                        buffer_size: int = JOIN_LIMIT) -> None:
+    """
+    Send a length-prefixed message from a stream of chunks.
+
+    Small chunks are gathered up to buffer_size bytes before each send.
+
+    :param sock: The socket to send the message to.
+    :param chunks: The chunks of the message.
+    :param size: The total size of the chunks.
+    :param buffer_size: The number of bytes gathered before each send.
+    :return: None.
+    """
+    buffer = bytearray(HEADER.pack(size))
+    sent = 0
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= buffer_size:
+            sock.sendall(buffer)
+            sent += len(buffer)
+            buffer.clear()
+    sock.sendall(buffer)
+    sent += len(buffer)
+    if sent != size + HEADER.size:
+        raise ConnectionError(f"Sent {sent - HEADER.size} bytes instead of {size} bytes.")
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytearray:
+    """
+    Receive exactly size bytes into one buffer.
+
+    Sizes up to INITIAL_BUFFER_SIZE are allocated at once, larger buffers
+    double when they are full, so the memory used follows the bytes received.
+
+    :param sock: The socket to receive from.
+    :param size: The number of bytes to receive.
+    :return: The received bytes.
+    """
+    buffer = bytearray(min(size, INITIAL_BUFFER_SIZE))
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        if received == len(buffer):
+            # A bytearray cannot be resized while a view of it exists
+            view.release()
+            buffer += bytes(min(len(buffer), size - len(buffer)))
+            view = memoryview(buffer)
+        nbytes = sock.recv_into(view[received:], len(buffer) - received)
+        if nbytes == 0:
+            raise ConnectionError("Connection closed by the peer.")
+        received += nbytes
+    view.release()
+    return buffer
+
+
+def recv_message(sock: socket.socket,
+                 max_size: int = MAX_MESSAGE_SIZE,
+                 on_header: Union[Callable[[], object], None] = None) -> bytearray:
+    """
+    Receive a whole length-prefixed message.
 
+    :param sock: The socket to receive from.
+    :param max_size: The maximum size of the message.
+    :param on_header: Called once the length prefix is received, such as the start of a timer.
+    :return: The message.
+    """
+    size, = HEADER.unpack(recv_exact(sock, HEADER.size))
+    if on_header is not None:
+        on_header()
+    if size > max_size:
+        raise ConnectionError(f"Message of {size} bytes exceeds {max_size} bytes.")
+    return recv_exact(sock, size)
+
+
+def recv_into_file(sock: socket.socket,
+                   size: int,
+                   write: Union[Callable[[memoryview], object], None] = None,
+                   buffer_size: int = FILE_BUFFER_SIZE) -> None:
+    """
+    Receive exactly size bytes through one preallocated buffer, without a length prefix.
+
+    Each received chunk is passed to write as a view of the buffer, so
+    files of any size are received in constant memory.
 
-def dict_to_xml_string(dict_val: dict, root_tag: str = 'root') -> str:
+    :param sock: The socket to receive from.
+    :param size: The number of bytes to receive.
+    :param write: The function writing each chunk, such as the write method of a file,
+        or None to discard the bytes.
+    :param buffer_size: The size of the buffer.
+    :return: None.
+    """
+    view = memoryview(bytearray(min(size, buffer_size)))
+    remaining = size
+    while remaining > 0:
+        nbytes = sock.recv_into(view, min(remaining, len(view)))
+        if nbytes == 0:
+            raise ConnectionError("Connection closed by the peer.")
+        if write is not None:
+            write(view[:nbytes])
+        remaining -= nbytes
+
+
+def dict_to_xml_string(dict_val: dict, root_tag: str = 'root') -> bytes:
     """
     Convert a dictionary to an XML string.
 
+    The XML is generated incrementally by cs_network/xmlstream.py,
+    without building an element tree.
+
     :param dict_val: The dictionary to convert.
     :param root_tag: The root tag of the XML string.
     :return: The XML string.
     """
-    def dict_to_xml(dict_val: dict, tag: str = root_tag) -> Element:
-        """
-        Convert a dictionary to an XML element.
+    return b''.join(iter_xml(dict_val, root_tag))
 
-        :param dict_val: The dictionary to convert.
-        :param tag: The tag of the element.
-        :return: The XML element.
-        """
-        root = Element(tag)
-        for key, value in dict_val.items():
-            child = Element(str(key))
-            # Recursively call this function to support nested dictionaries
-            if isinstance(value, dict):
-                child.append(list(dict_to_xml(value))[0])
-            else:
-                child.text = str(value)
-            root.append(child)
-        return root
-    return tostring(dict_to_xml(dict_val), encoding='utf-8')
 
+# Tag names the XML parser accepts, without namespace prefixes, checked by
+# this pattern when the name is ASCII and by the parser otherwise
+XML_ASCII_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_.\-]*')
+# Characters allowed in XML text, markup characters are escaped when writing
+XML_CHARS = re.compile('[\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]*')
 
+
+@lru_cache(maxsize=4096)
 def validate_xml_key(xml_str: str) -> bool:
     """
-    Validate an XML string.
+    Validate that a string can be used as an XML tag.
 
-    :param xml_str: The XML string to validate.
-    :return: True if the XML string is valid, False otherwise.
+    :param xml_str: The tag to validate.
+    :return: True if the tag is valid, False otherwise.
     """
+    if xml_str.isascii():
+        return XML_ASCII_NAME.fullmatch(xml_str) is not None
+    # Non-ASCII names follow the character tables of the parser
+    parser = expat.ParserCreate(namespace_separator='}')
     try:
-        parseString(f'<{xml_str}>a</{xml_str}>')
+        parser.Parse(f'<{xml_str} />'.encode('utf-8'), True)
         return True
-    except ExpatError:
+    except (expat.ExpatError, UnicodeEncodeError):
         return False
 
 
-def validate_xml_value(xml_str: str) -> bool:
+def validate_xml_value(xml_str: object) -> bool:
     """
-    Validate that the XML string is valid.
+    Validate that the value only has characters allowed in XML.
 
-    :param xml_str: The XML string to validate.
-    :return: True if the XML string is valid, False otherwise.
+    :param xml_str: The value to validate, it is converted to a string.
+    :return: True if the value is valid, False otherwise.
     """
-    try:
-        parseString(f'<a>{xml_str}</a>')
-        return True
-    except ExpatError:
-        return False
+    return XML_CHARS.fullmatch(str(xml_str)) is not None
+
+
+def validate_xml_dict(dict_val: dict) -> bool:
+    """
+    Validate that the keys and values of a nested dictionary can be converted to XML.
+
+    :param dict_val: The dictionary to validate.
+    :return: True if the dictionary is valid, False otherwise.
+    """
+    stack = [dict_val]
+    while stack:
+        for key, value in stack.pop().items():
+            if not validate_xml_key(str(key)):
+                return False
+            # The items of lists are written as elements with the tag of their key
+            items = [value]
+            while items:
+                item = items.pop()
+                if isinstance(item, dict):
+                    stack.append(item)
+                elif isinstance(item, (list, tuple)):
+                    items.extend(item)
+                elif not validate_xml_value(item):
+                    return False
+    return True
 
 
 def network_config(retry: int = 3, default_port: int = 50541) -> tuple:
@@ -144,12 +308,12 @@ def validation(config_input: str, input_tup: tuple, err_msg: str = "Invalid inpu
 
 
 def data_config(retry: int = 3,
-                example_key: rsa.PublicKey = EXAMPLE_PUB_KEY) -> dict:
+                example_key: Union[rsa.PublicKey, None] = None) -> dict:
     """
     Get the user's configuration data.
 
     :retry: The number of times to retry the input.
-    :example_key: The example key to use.
+    :example_key: The example key to use, defaults to the example public key.
     :return: The user's configuration data.
     """
     # Data config
@@ -233,12 +397,12 @@ def data_config(retry: int = 3,
                     "Enter the public key .pem file path, or press enter to use example key: "
                 ).strip()
                 if config['public_key'] == '':
-                    config['public_key'] = example_key
+                    config['public_key'] = example_key or get_example_pub_key()
                     print("Using example public key")
                     break
                 if exists(config['public_key']):
                     if config['public_key'].split('.')[-1] == 'pem':
-                        config['public_key'] = load_pub_key(
+                        config['public_key'] = load_pub_key_cached(
                             config['public_key'])
                     break
                 raise FileNotFoundError
@@ -256,8 +420,8 @@ def data_config(retry: int = 3,
     if config['type'] == 1 and config['encrypt'] == 2:
         for _ in range(retry):
             config['serialize'] = input(
-                "Select serialization method (1) Binary (2) JSON (3) XML: ").strip()
-            valid_range = (1, 2, 3)
+                "Select serialization method (1) Binary (2) JSON (3) XML (4) MessagePack: ").strip()
+            valid_range = (1, 2, 3, 4)
             if validation(config['serialize'], valid_range, error_message + str(valid_range)):
                 config['serialize'] = int(config['serialize'])
                 break
@@ -359,21 +523,20 @@ def data_input(config_dict: dict, max_bytes: int = 1024) -> Union[str, dict]:
     :max_bytes: The maximum number of bytes to send.
     :return: The user's data.
     """
-    def size_check(data: Union[str, dict], serial_method: int = config_dict['serialize']) -> bool:
+    # The size of the dictionary is updated as each key is added,
+    # instead of serializing the whole dictionary again
+    sizes = SizeEstimator(config_dict['serialize']) if config_dict['type'] == 1 else None
+
+    def size_check(data: Union[str, dict]) -> bool:
         """
         Check if the data is too large to send.
 
-        :data: The data to check.
-        :serial_method: Serialization method.
+        :data: The data to check, a dictionary must have been added to sizes.
         :return: False if the data is too large and return the size difference,
                  return True and the size otherwise.
         """
-        if serial_method == 1:
-            size = len(pickle.dumps(data))
-        elif serial_method == 2:
-            size = len(json.dumps(data).encode('utf-8'))
-        elif serial_method == 3:
-            size = len(dict_to_xml_string(data))
+        if isinstance(data, dict):
+            size = sizes.size()
         else:
             size = len(data.encode('utf-8'))
         compare = max_bytes-size
@@ -418,17 +581,15 @@ def data_input(config_dict: dict, max_bytes: int = 1024) -> Union[str, dict]:
             xvalue = literal_eval(dvalue)
             if config_dict['serialize'] == 3:
                 if isinstance(xvalue, dict):
-                    xml_string = dict_to_xml_string(xvalue)
-                    try:
-                        parseString(xml_string)
-                    except ExpatError:
-                        print("Invalid value for XML.")
-                        continue
-                if validate_xml_value(xvalue):
+                    valid = validate_xml_dict(xvalue)
+                else:
+                    valid = validate_xml_value(dvalue)
+                if valid:
                     if isinstance(xvalue, dict):
                         data[key] = xvalue
                     else:
                         data[key] = dvalue
+                    sizes.add(key, data[key])
                     scheck, size = size_check(data)
                     print(f'Dictionary: {data} \nSize: {size} bytes')
                     continue
@@ -448,6 +609,7 @@ def data_input(config_dict: dict, max_bytes: int = 1024) -> Union[str, dict]:
                     continue
             else:
                 data[key] = dvalue
+        sizes.add(key, data[key])
         scheck, size = size_check(data)
         print(f'Dictionary: {data} \nSize: {size} bytes')
     return data
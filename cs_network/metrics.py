@@ -0,0 +1,184 @@
+"""Latency of each stage of the messages, by serialization and encryption."""
+import threading
+from time import perf_counter_ns
+from collections import deque
+from typing import Union
+
+# Number of latest samples kept for each stage
+WINDOW = 4096
+PERCENTILES = (50, 95, 99)
+
+
+class NullTimer:
+    """Timer used when the latency is not measured, every method does nothing."""
+
+    def start(self) -> None:
+        """
+        Do nothing.
+
+        :return: None.
+        """
+
+    def lap(self, stage: str) -> None:
+        """
+        Do nothing.
+
+        :param stage: The name of the stage.
+        :return: None.
+        """
+
+    def finish(self, config_dict: Union[dict, None]) -> None:
+        """
+        Do nothing.
+
+        :param config_dict: The dictionary of config of the message.
+        :return: None.
+        """
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    """
+    Timer of the stages of one message.
+
+    The laps are kept until the message is finished, as the serialization and
+    encryption of the message are only known once its config is received.
+    """
+
+    __slots__ = ('stats', 'laps', 'last')
+
+    def __init__(self, stats: 'LatencyStats') -> None:
+        """
+        Start timing a message.
+
+        :param stats: The statistics to add the laps to.
+        """
+        self.stats = stats
+        self.laps = []
+        self.last = perf_counter_ns()
+
+    def start(self) -> None:
+        """
+        Restart the time of the first stage, such as when the message starts to arrive.
+
+        :return: None.
+        """
+        self.last = perf_counter_ns()
+
+    def lap(self, stage: str) -> None:
+        """
+        Record the time since the previous lap as the time of a stage.
+
+        :param stage: The name of the stage.
+        :return: None.
+        """
+        now = perf_counter_ns()
+        self.laps.append((stage, now - self.last))
+        self.last = now
+
+    def finish(self, config_dict: Union[dict, None]) -> None:
+        """
+        Add the laps to the statistics of the serialization and encryption of the message.
+
+        :param config_dict: The dictionary of config of the message, None to discard the laps.
+        :return: None.
+        """
+        if config_dict is not None and self.laps:
+            self.stats.add((config_dict.get('serialize'), config_dict.get('encrypt')), self.laps)
+        self.laps = []
+
+
+def percentile(samples: list, percent: float) -> int:
+    """
+    Get a percentile of sorted samples, by the nearest rank.
+
+    :param samples: The sorted samples.
+    :param percent: The percentile, from 0 to 100.
+    :return: The sample at the percentile.
+    """
+    rank = max(int(len(samples) * percent / 100 + 0.5) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+class LatencyStats:
+    """
+    Rolling latency samples of each stage of the messages.
+
+    The samples are grouped by the serialization and encryption of the
+    messages, and only the latest samples of each stage are kept.
+    """
+
+    def __init__(self, window: int = WINDOW) -> None:
+        """
+        Start without samples.
+
+        :param window: The number of latest samples kept for each stage.
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        # Samples in nanoseconds, by (serialize, encrypt) and stage
+        self.samples = {}
+
+    def timer(self) -> StageTimer:
+        """
+        Start timing a message.
+
+        :return: The timer of the message.
+        """
+        return StageTimer(self)
+
+    def add(self, key: tuple, laps: list) -> None:
+        """
+        Add the stage times of a message, and their total.
+
+        :param key: The (serialize, encrypt) of the message.
+        :param laps: The (stage, nanoseconds) of the message.
+        :return: None.
+        """
+        with self.lock:
+            stages = self.samples.setdefault(key, {})
+            for stage, nanoseconds in laps + [('total', sum(lap[1] for lap in laps))]:
+                if stage not in stages:
+                    stages[stage] = deque(maxlen=self.window)
+                stages[stage].append(nanoseconds)
+
+    def summary(self) -> dict:
+        """
+        Get the count and percentiles of each stage.
+
+        :return: {(serialize, encrypt): {stage: {'count': ..., 'p50': ..., ...}}}, in milliseconds.
+        """
+        with self.lock:
+            samples = {key: {stage: sorted(times) for stage, times in stages.items()}
+                       for key, stages in self.samples.items()}
+        return {key: {stage: {'count': len(times)} | {
+                    f'p{percent}': percentile(times, percent) / 1e6 for percent in PERCENTILES}
+                      for stage, times in stages.items()}
+                for key, stages in samples.items()}
+
+    def report(self) -> str:
+        """
+        Format the percentiles of each stage as a table.
+
+        :return: The table.
+        """
+        lines = []
+        for (serialize, encrypt), stages in self.summary().items():
+            lines.append(f"Latency (ms) for serialize {serialize}, encrypt {encrypt}:")
+            lines.append(f"  {'stage':<14}{'count':>8}" + ''.join(
+                f"{f'p{percent}':>10}" for percent in PERCENTILES))
+            for stage, stats in stages.items():
+                lines.append(f"  {stage:<14}{stats['count']:>8}" + ''.join(
+                    f"{stats[f'p{percent}']:>10.3f}" for percent in PERCENTILES))
+        return '\n'.join(lines) or "No latency samples."
+
+    def reset(self) -> None:
+        """
+        Remove every sample.
+
+        :return: None.
+        """
+        with self.lock:
+            self.samples = {}
@@ -0,0 +1,212 @@
+"""Append-only log of records split into segment files, committed in groups."""
+import os
+import glob
+import time
+import struct
+import threading
+import zlib
+from typing import Iterator, Union
+
+# Sequence number, payload length, CRC-32 of the format and payload, and format length
+RECORD_HEADER = struct.Struct('!QIIB')
+SEGMENT_SUFFIX = '.log'
+
+
+def read_segment(path: str) -> Iterator[tuple]:
+    """
+    Read the records of a segment file.
+
+    Reading stops at the first incomplete or corrupted record, which is
+    what remains of a record being written when the server stopped.
+
+    :param path: The path of the segment file.
+    :return: An iterator of (sequence number, format, payload, end offset) tuples.
+    """
+    with open(path, 'rb') as segment:
+        offset = 0
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            seq, length, crc, fmt_length = RECORD_HEADER.unpack(header)
+            body = segment.read(fmt_length + length)
+            if len(body) < fmt_length + length or zlib.crc32(body) != crc:
+                return
+            offset += RECORD_HEADER.size + len(body)
+            yield seq, body[:fmt_length].decode('utf-8'), body[fmt_length:], offset
+
+
+def list_segments(prefix: str) -> list:
+    """
+    List the segment files of a log in order.
+
+    :param prefix: The path prefix of the segment files.
+    :return: The paths of the segment files.
+    """
+    return sorted(glob.glob(glob.escape(prefix) + '_' + '[0-9]' * 12 + SEGMENT_SUFFIX))
+
+
+def iter_log(prefix: str) -> Iterator[tuple]:
+    """
+    Read the records of every segment of a log in order.
+
+    :param prefix: The path prefix of the segment files.
+    :return: An iterator of (sequence number, format, payload) tuples.
+    """
+    for path in list_segments(prefix):
+        for seq, fmt, payload, _ in read_segment(path):
+            yield seq, fmt, payload
+
+
+class SegmentLog:
+    """
+    Append-only log of records, split into segment files of limited size and age.
+
+    Records are written to a buffered segment file, and committed to the disk
+    with a single flush and fsync for every record written since the last
+    commit, so concurrent writers share the cost of an fsync. Every record has
+    a unique sequence number, which continues from the existing segments when
+    the log is reopened.
+    """
+
+    def __init__(self,
+                 prefix: str,
+                 segment_bytes: int = 64 << 20,
+                 segment_seconds: Union[float, None] = 3600,
+                 sync: bool = True) -> None:
+        """
+        Open the log, recovering the sequence number from the existing segments.
+
+        :param prefix: The path prefix of the segment files.
+        :param segment_bytes: The size above which a new segment is started.
+        :param segment_seconds: The age above which a new segment is started, None for no limit.
+        :param sync: Wait for each record to be committed to the disk in append.
+        """
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.sync = sync
+        # The write lock orders the records, the commit lock lets a single writer
+        # fsync at a time while the others wait to find their record committed
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.next_seq = self.recover()
+        self.written_seq = self.committed_seq = self.next_seq - 1
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.opened = 0.0
+        self.open_segment()
+
+    def recover(self) -> int:
+        """
+        Find the next sequence number, removing an incomplete record from the last segment.
+
+        :return: The next sequence number.
+        """
+        segments = list_segments(self.prefix)
+        if not segments:
+            return 1
+        last = segments[-1]
+        # Segments are named by the sequence number of their first record
+        next_seq = int(last[-len(SEGMENT_SUFFIX) - 12:-len(SEGMENT_SUFFIX)])
+        end = 0
+        for seq, _, _, end in read_segment(last):
+            next_seq = seq + 1
+        if os.path.getsize(last) > end:
+            with open(last, 'r+b') as segment:
+                segment.truncate(end)
+        return next_seq
+
+    def open_segment(self) -> None:
+        """
+        Start a new segment file with the next record.
+
+        :return: None.
+        """
+        self.path = f'{self.prefix}_{self.next_seq:012d}{SEGMENT_SUFFIX}'
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+
+    def close_segment(self) -> None:
+        """
+        Commit and close the current segment file, the write lock must be held.
+
+        :return: None.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.committed_seq = max(self.committed_seq, self.written_seq)
+
+    def append(self, payload: bytes, fmt: str = '') -> int:
+        """
+        Append a record to the log.
+
+        :param payload: The data of the record.
+        :param fmt: The format of the data, such as the file extension.
+        :return: The sequence number of the record.
+        """
+        encoded_fmt = fmt.encode('utf-8')
+        record_size = RECORD_HEADER.size + len(encoded_fmt) + len(payload)
+        with self.lock:
+            if self.file is None:
+                raise ValueError("The log is closed.")
+            if self.size and (self.size + record_size > self.segment_bytes or (
+                    self.segment_seconds is not None
+                    and time.monotonic() - self.opened > self.segment_seconds)):
+                self.close_segment()
+                self.open_segment()
+            seq = self.next_seq
+            self.next_seq += 1
+            crc = zlib.crc32(payload, zlib.crc32(encoded_fmt))
+            self.file.write(RECORD_HEADER.pack(seq, len(payload), crc, len(encoded_fmt)))
+            self.file.write(encoded_fmt)
+            self.file.write(payload)
+            self.size += record_size
+            self.written_seq = seq
+        if self.sync:
+            self.commit(seq)
+        return seq
+
+    def commit(self, seq: Union[int, None] = None) -> None:
+        """
+        Wait until a record is committed to the disk, committing every record written so far.
+
+        :param seq: The sequence number of the record, defaults to the last record written.
+        :return: None.
+        """
+        with self.commit_lock:
+            with self.lock:
+                if seq is None:
+                    seq = self.written_seq
+                if self.committed_seq >= seq or self.file is None:
+                    return
+                self.file.flush()
+                target = self.written_seq
+                # The duplicate stays open if the segment is rotated during the fsync
+                fileno = os.dup(self.file.fileno())
+            try:
+                os.fsync(fileno)
+            finally:
+                os.close(fileno)
+            with self.lock:
+                self.committed_seq = max(self.committed_seq, target)
+
+    def close(self) -> None:
+        """
+        Commit the records and close the log.
+
+        :return: None.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.close_segment()
+                self.file = None
+
+    def __enter__(self) -> 'SegmentLog':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,18 +1,33 @@
 """Server functions for the server side of the network."""
+import io
+import os
 import socket
+import string
 import sys
 import json
 import time
 import pickle
 import base64
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
 from ast import literal_eval
-import xml.dom.minidom
-from typing import Union
-from os.path import dirname, join, abspath, exists
+from xml.etree.ElementTree import ParseError
+from typing import Callable, Union
+from os.path import dirname, join, abspath, exists, isdir
 import rsa
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
-from cs_network import network_config, server_config
-from encryption import decrypt, EXAMPLE_PRIV_KEY, load_priv_key
+from cs_network import network_config, server_config, send_message, recv_message
+from cs_network.functions import recv_into_file, MAX_MESSAGE_SIZE, MAX_CONFIG_SIZE
+from cs_network.binary import packb, unpackb
+from cs_network.xmlstream import write_pretty_xml, iter_children
+from cs_network.segment_log import SegmentLog
+from cs_network.compression import decompress
+from cs_network.metrics import LatencyStats, StageTimer, NULL_TIMER
+from encryption import decrypt, hybrid_decrypt, get_example_priv_key, load_priv_key_cached
+from encryption import open_session, symmetric_decrypt, decrypt_stream
+from encryption import iter_blocks, start_decrypt_pool, decrypt_many, DecryptContext
 
 
 def initialize_server(host: str, port: int, backlog: int = 1) -> socket.socket:
@@ -36,22 +51,56 @@ def initialize_server(host: str, port: int, backlog: int = 1) -> socket.socket:
         sys.exit(1)
 
 
-def receive_config(connection: socket.socket, address: str = '', retry: int = 3) -> dict:
+def cache_config(config_dict: dict, configs: dict, max_configs: int = 16) -> None:
+    """
+    Cache a config under its config id for later messages of the config session.
+
+    The encrypted session key is only needed for the first message, and the
+    sequence number belongs to a single message, so they are not cached.
+
+    :param config_dict: The dictionary of config with a config_id.
+    :param configs: The cached configs of the connection, by config id.
+    :param max_configs: The maximum number of cached configs, the oldest is dropped first.
+    :return: None.
+    """
+    configs.pop(config_dict['config_id'], None)
+    configs[config_dict['config_id']] = {
+        key: value for key, value in config_dict.items() if key not in ('session_key', 'seq')}
+    while len(configs) > max_configs:
+        del configs[next(iter(configs))]
+
+
+def receive_config(connection: socket.socket,
+                   address: str = '',
+                   retry: int = 3,
+                   configs: Union[dict, None] = None,
+                   timer: StageTimer = NULL_TIMER) -> Union[dict, None]:
     """
     Receive config from a connection.
 
+    With configs, a config with a config_id is cached for the config session,
+    and a message with only the config_id, and optionally a sequence number,
+    is resolved to the cached config without sending CONFIG_OK.
+
     :param connection: The connection to receive data from.
     :param address: The address of the connection.
     :param retry: The number of times to retry the connection.
-    :return: The dictionary of data.
+    :param configs: The cached configs of the connection, by config id.
+    :param timer: The timer of the message stages, started once the config starts to arrive.
+    :return: The dictionary of data, or None if the client ended the config session.
     """
     # receive the data
     for i in range(1, retry+1):
+        recv_data = b''
         try:
-            recv_data = connection.recv(1024)
+            recv_data = recv_message(connection, MAX_CONFIG_SIZE, timer.start)
+            timer.lap('recv_config')
             if address != '':
                 print('Connected by', address)
             connection_ok = True
+        except ConnectionError:
+            # The client closed the connection
+            raise
         except socket.error:
             print("Connection Error on receiving config.")
             connection_ok = False
@@ -59,16 +108,25 @@ def receive_config(connection: socket.socket, address: str = '', retry: int = 3)
             print("No configuration received.")
         try:
             recv_data = json.loads(recv_data)
+            timer.lap('parse_config')
+            if configs is not None and isinstance(recv_data, int):
+                return None
+            if configs is not None and isinstance(recv_data, dict) and 'config_id' in recv_data:
+                if 'type' not in recv_data:
+                    # Unknown config ids are returned as is and rejected with the data,
+                    # the fields of the reference, like the sequence number, are kept
+                    return configs.get(recv_data['config_id'], {}) | recv_data
+                cache_config(recv_data, configs)
             if connection_ok:
-                connection.sendall('CONFIG_OK'.encode('utf-8'))
+                send_message(connection, 'CONFIG_OK'.encode('utf-8'))
                 return recv_data
             else:
                 print("Connection Error on sending CONFIG_OK response.")
         except json.decoder.JSONDecodeError:
             print("Could not decode the data.\nPlease check the data.")
             if connection_ok:
-                connection.sendall(
-                    'CONFIG_ERROR: JSONDecodeError'.encode('utf-8'))
+                send_message(connection,
+                             'CONFIG_ERROR: JSONDecodeError'.encode('utf-8'))
             else:
                 print("Connection Error on sending CONFIG DECODE ERROR response.")
         print(f"Receive config error. Retry {i} of {repr(retry)}")
@@ -87,8 +145,11 @@ def receive_data(connection: socket.socket, retry: int = 3) -> bytes:
     # receive the data
     for i in range(retry):
         try:
-            recv_data = connection.recv(2048)
+            recv_data = recv_message(connection)
             return recv_data
+        except ConnectionError:
+            # The client closed the connection
+            raise
         except socket.error:
             print("Connection Error on receiving data.")
         print(f"Receive data error. Retry {i+1} of {retry}")
@@ -107,7 +168,7 @@ def send_response(connection: socket.socket, response: str, retry: int = 3) -> N
     """
     for i in range(retry):
         try:
-            connection.sendall(response.encode('utf-8'))
+            send_message(connection, response.encode('utf-8'))
             return None
         except socket.error:
             print(f"Could not send the response. Retry {i+1} of {retry}")
@@ -116,13 +177,13 @@ def send_response(connection: socket.socket, response: str, retry: int = 3) -> N
 
 
 def get_private_key(retry: int = 3,
-                    example_key: rsa.PrivateKey = EXAMPLE_PRIV_KEY
+                    example_key: Union[rsa.PrivateKey, None] = None
                     ) -> rsa.PrivateKey:
     """
     Get the server private key.
 
     :param retry: The number of times to retry the connection.
-    :param example_key: The example private key.
+    :param example_key: The example private key, defaults to the example private key.
     :return: The private key.
     """
     keypath = ''
@@ -133,12 +194,12 @@ def get_private_key(retry: int = 3,
                 "Enter the private key .pem file path, or press Enter to use example key: "
             ).strip()
             if keypath == '':
-                priv_key = example_key
+                priv_key = example_key or get_example_priv_key()
                 print("Using example private key.")
                 break
             if exists(keypath):
                 if keypath.split('.')[-1] == 'pem':
-                    priv_key = load_priv_key(keypath)
+                    priv_key = load_priv_key_cached(keypath)
                 break
             raise FileNotFoundError
         except FileNotFoundError:
@@ -177,22 +238,226 @@ def print_to_terminal(text: str) -> None:
     print("------------End Output------------")
 
 
+def get_session_key(config_dict: dict,
+                    priv_key: rsa.PrivateKey,
+                    sessions: dict) -> bytes:
+    """
+    Get the session key of a message, decrypting it on first use.
+
+    :param config_dict: The dictionary of config.
+    :param priv_key: The private key.
+    :param sessions: The session keys of the connection, by session id.
+    :return: The session key.
+    """
+    if 'session_key' in config_dict:
+        sessions[config_dict['session_id']] = open_session(
+            base64.b64decode(config_dict['session_key']), priv_key)
+    return sessions[config_dict['session_id']]
+
+
+def write_output(server_configuration: dict,
+                 extension: str,
+                 write: Callable,
+                 binary: bool = False) -> str:
+    """
+    Write the output of a message to a new file, or as a record of the log sink.
+
+    :param server_configuration: The server configuration, with a SegmentLog as 'sink' for a log.
+    :param extension: The file extension of the output format.
+    :param write: The function writing the output to a file object.
+    :param binary: Write bytes instead of text.
+    :return: Where the output was written.
+    """
+    sink = server_configuration.get('sink')
+    if sink is not None:
+        buffer = io.BytesIO()
+        if binary:
+            write(buffer)
+        else:
+            text_buffer = io.TextIOWrapper(buffer, encoding='utf-8')
+            write(text_buffer)
+            text_buffer.flush()
+        seq = sink.append(buffer.getvalue(), extension)
+        return f"record {seq} of {sink.prefix} log"
+    time_txt = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    filepath = server_configuration['filepath']+'_'+time_txt+'.'+extension
+    if binary:
+        with open(filepath, 'wb') as out_file:
+            write(out_file)
+    else:
+        with open(filepath, 'w', encoding='utf-8') as out_file:
+            write(out_file)
+    return filepath
+
+
+def create_output_file(server_configuration: dict, filename: str) -> tuple:
+    """
+    Create a new file for a received file, without replacing an existing file.
+
+    :param server_configuration: The server configuration.
+    :param filename: The name of the received file, only letters, digits and _.- are kept.
+    :return: The file opened for writing bytes, and its path.
+    """
+    valid_chars = string.ascii_letters + string.digits + '_.-'
+    filename = ''.join(char if char in valid_chars else '_'
+                       for char in os.path.basename(filename.replace('\\', '/'))).lstrip('.')
+    time_txt = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    base_path = f"{server_configuration['filepath']}_{time_txt}_{filename or 'file'}"
+    filepath = base_path
+    num = 1
+    while True:
+        try:
+            return open(filepath, 'xb'), filepath
+        except FileExistsError:
+            filepath = f'{base_path}.{num}'
+            num += 1
+
+
+def receive_file(connection: socket.socket,
+                 config_dict: dict,
+                 server_configuration: dict) -> str:
+    """
+    Receive a file sent as it is, straight into its output file.
+
+    The file is received through one preallocated buffer, so files of any
+    size are received in constant memory. With console output, the file is
+    discarded and only its name and size are printed. Files are written to
+    their own file even when the output is a log.
+
+    :param connection: The connection to receive the file from.
+    :param config_dict: The dictionary of config, with the filename and size.
+    :param server_configuration: The server configuration.
+    :return: The status message.
+    """
+    size = config_dict.get('size')
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        # The end of the file cannot be found without its size
+        raise ConnectionError("Invalid file size.")
+    filename = str(config_dict.get('filename', ''))
+    if server_configuration['output_method'] != 1:
+        recv_into_file(connection, size)
+        print_to_terminal(f"Received {filename} of {size} bytes")
+        return 'DATA_OK'
+    try:
+        out_file, filepath = create_output_file(server_configuration, filename)
+    except OSError:
+        recv_into_file(connection, size)
+        return 'DATA_ERROR: Could not write to file.'
+    failed = False
+
+    def write(chunk: memoryview) -> None:
+        # The rest of the file is still received after a write error
+        nonlocal failed
+        if not failed:
+            try:
+                out_file.write(chunk)
+            except OSError:
+                failed = True
+
+    with out_file:
+        recv_into_file(connection, size, write)
+    if failed:
+        return 'DATA_ERROR: Could not write to file.'
+    print_to_terminal(f"{size} bytes written to {filepath}")
+    return 'DATA_OK'
+
+
+def output_batch(config_dict: dict,
+                 recv_data: Union[str, list],
+                 server_configuration: dict) -> str:
+    """
+    Output the records of a batch, opening a single file for the whole batch.
+
+    :param config_dict: The dictionary of config.
+    :param recv_data: The deserialized and decrypted batch.
+    :param server_configuration: The server configuration.
+    :return: The status message.
+    """
+    try:
+        if config_dict['encrypt'] == 1:
+            records = literal_eval(recv_data)
+        elif config_dict['type'] == 2:
+            records = json.loads(recv_data)
+        elif config_dict['serialize'] == 3:
+            records = list(iter_children(recv_data))
+        else:
+            records = recv_data
+    except (ValueError, SyntaxError):
+        print("Could not read the records of the batch.")
+        return 'DATA_ERROR: Invalid batch'
+    if not isinstance(records, list):
+        return 'DATA_ERROR: Invalid batch'
+
+    # Output the records to terminal
+    if server_configuration['output_method'] == 2:
+        for record in records:
+            if config_dict['serialize'] == 1 and config_dict['type'] == 1:
+                print_dict(record)
+            else:
+                print_to_terminal(record)
+    # Output the records to one file
+    elif server_configuration['output_method'] == 1:
+        try:
+            if config_dict['serialize'] == 1 and config_dict['type'] == 1:
+                filepath = write_output(
+                    server_configuration, 'p',
+                    lambda out_file: pickle.dump(records, out_file), binary=True)
+            elif config_dict['serialize'] == 2 and config_dict['type'] == 1:
+                filepath = write_output(
+                    server_configuration, 'json',
+                    lambda out_file: json.dump(records, out_file, indent=4))
+            elif config_dict['serialize'] == 4 and config_dict['type'] == 1:
+                filepath = write_output(
+                    server_configuration, 'msgpack',
+                    lambda out_file: out_file.write(packb(records)), binary=True)
+            elif config_dict['serialize'] == 3 and config_dict['type'] == 1:
+                filepath = write_output(
+                    server_configuration, 'xml',
+                    lambda out_file: write_pretty_xml(recv_data, out_file.write))
+            else:
+                filepath = write_output(
+                    server_configuration, 'txt',
+                    lambda out_file: out_file.writelines(
+                        f"{record}\n" for record in records))
+            print_to_terminal(f"{len(records)} records written to {filepath}")
+        except OSError:
+            return 'DATA_ERROR: Could not write to file.'
+    return 'DATA_OK'
+
+
 def process_recv_data(config_dict: dict,
                       recv_data: bytes,
                       server_configuration: dict,
-                      priv_key: rsa.PrivateKey = EXAMPLE_PRIV_KEY) -> str:
+                      priv_key: Union[rsa.PrivateKey, None] = None,
+                      sessions: Union[dict, None] = None,
+                      decrypt_pool: Union[ProcessPoolExecutor, None] = None,
+                      timer: StageTimer = NULL_TIMER) -> str:
     """
     Process the received data.
 
     :param config_dict: The dictionary of config.
     :param recv_data: The received data.
     :param server_configuration: The server configuration.
-    :param priv_key: The private key.
+    :param priv_key: The private key, or a DecryptContext, defaults to the example private key.
+    :param sessions: The session keys of the connection, by session id.
+    :param decrypt_pool: The process pool to decrypt RSA blocks with.
+    :param timer: The timer of the message stages.
     :return: The processed data.
     """
+    if sessions is None:
+        sessions = {}
     # Initialize the variables
     status = 'DATA_OK'
 
+    # Decompress the data, encrypted data is decompressed after it is decrypted
+    if config_dict.get('compress') and config_dict['encrypt'] == 2:
+        try:
+            recv_data = decompress(recv_data, config_dict['compress'], MAX_MESSAGE_SIZE)
+        except ValueError:
+            print("Could not decompress the data.")
+            return 'DATA_ERROR: Invalid compressed data'
+        timer.lap('decompress')
+
     # Deserialize the data
     if config_dict['type'] == 1:
         if config_dict['serialize'] == 1:
@@ -201,20 +466,62 @@ def process_recv_data(config_dict: dict,
             recv_data = json.loads(recv_data.decode('utf-8'))
         elif config_dict['serialize'] == 3:
             recv_data = recv_data.decode('utf-8')
+        elif config_dict['serialize'] == 4:
+            try:
+                recv_data = unpackb(recv_data)
+            except ValueError:
+                print("Could not deserialize the MessagePack data.")
+                return 'DATA_ERROR: Invalid MessagePack data'
         else:
             print("Invalid serialize type.")
             status = 'DATA_ERROR: Invalid serialize type.'
     elif config_dict['type'] == 2 and config_dict['encrypt'] == 2:
         recv_data = recv_data.decode('utf-8')
+    timer.lap('deserialize')
 
     # Decrypt the data
     if config_dict['encrypt'] == 1:
+        if priv_key is None:
+            priv_key = get_example_priv_key()
         try:
-            recv_data = decrypt(recv_data, priv_key).decode('utf-8')
+            if config_dict.get('cipher') == 'session':
+                recv_data = symmetric_decrypt(
+                    recv_data, get_session_key(config_dict, priv_key, sessions))
+            elif config_dict.get('cipher') == 'stream' and decrypt_pool is not None:
+                recv_data = b''.join(decrypt_many(
+                    decrypt_pool, iter_blocks([recv_data], rsa.common.byte_size(priv_key.n))))
+            elif config_dict.get('cipher') == 'stream':
+                recv_data = b''.join(decrypt_stream([recv_data], priv_key))
+            elif config_dict.get('cipher') == 'hybrid':
+                recv_data = hybrid_decrypt(recv_data, priv_key)
+            elif decrypt_pool is not None:
+                recv_data = decrypt_many(decrypt_pool, [recv_data])[0]
+            else:
+                recv_data = decrypt(recv_data, priv_key)
         except (rsa.pkcs1.DecryptionError, AttributeError):
             print("Decryption Error: Could not decrypt the data.")
             status = 'DATA_ERROR: DecryptionError'
             recv_data = base64.b64encode(recv_data).decode('utf-8')
+        except KeyError:
+            print("Decryption Error: Unknown session.")
+            status = 'DATA_ERROR: Unknown session'
+            recv_data = base64.b64encode(recv_data).decode('utf-8')
+        else:
+            timer.lap('decrypt')
+            if config_dict.get('compress'):
+                try:
+                    recv_data = decompress(recv_data, config_dict['compress'], MAX_MESSAGE_SIZE)
+                except ValueError:
+                    print("Could not decompress the data.")
+                    return 'DATA_ERROR: Invalid compressed data'
+                timer.lap('decompress')
+            recv_data = recv_data.decode('utf-8')
+
+    # The records of a batch are output together
+    if config_dict.get('batch') and status == 'DATA_OK':
+        status = output_batch(config_dict, recv_data, server_configuration)
+        timer.lap('output')
+        return status
 
     # Output the data to terminal
     if server_configuration['output_method'] == 2:
@@ -225,82 +532,514 @@ def process_recv_data(config_dict: dict,
                 except (ValueError, SyntaxError):
                     print("Could not literal_eval the data.")
                     status = 'DATA_ERROR: ValueError'
+                timer.lap('literal_eval')
             print_dict(recv_data)
         else:
             print_to_terminal(recv_data)
     # Output the data to file
     elif server_configuration['output_method'] == 1:
-        time_txt = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-        filepath = server_configuration['filepath']+'_'+time_txt
         try:
             if config_dict['serialize'] == 1 and config_dict['type'] == 1:
-                filepath = filepath+'.p'
-                with open(filepath, 'wb') as pkl_file:
-                    pickle.dump(recv_data, pkl_file)
+                filepath = write_output(
+                    server_configuration, 'p',
+                    lambda out_file: pickle.dump(recv_data, out_file), binary=True)
                 print_to_terminal(f"Data written to {filepath}")
             elif config_dict['serialize'] == 2 and config_dict['type'] == 1:
-                filepath = filepath+'.json'
-                with open(filepath, 'w', encoding='utf-8') as json_file:
-                    json.dump(recv_data, json_file, indent=4)
+                filepath = write_output(
+                    server_configuration, 'json',
+                    lambda out_file: json.dump(recv_data, out_file, indent=4))
                 print_to_terminal(f"Data written to {filepath}")
             elif config_dict['serialize'] == 3 and config_dict['type'] == 1:
-                filepath = filepath+'.xml'
-                recv_data = xml.dom.minidom.parseString(recv_data).toprettyxml(
-                    indent='\t', encoding='utf-8').decode('utf-8').strip()
-                with open(filepath, 'w', encoding='utf-8') as xml_file:
-                    xml_file.write(recv_data)
+                # The XML is indented while it is parsed, straight into the file
+                filepath = write_output(
+                    server_configuration, 'xml',
+                    lambda out_file: write_pretty_xml(recv_data, out_file.write))
+                print_to_terminal(f"Data written to {filepath}")
+            elif config_dict['serialize'] == 4 and config_dict['type'] == 1:
+                filepath = write_output(
+                    server_configuration, 'msgpack',
+                    lambda out_file: out_file.write(packb(recv_data)), binary=True)
                 print_to_terminal(f"Data written to {filepath}")
             elif config_dict['type'] == 2:
-                filepath = filepath+'.txt'
-                with open(filepath, 'w', encoding='utf-8') as txt_file:
-                    txt_file.write(str(recv_data))
+                filepath = write_output(
+                    server_configuration, 'txt',
+                    lambda out_file: out_file.write(str(recv_data)))
                 print_to_terminal(f"Data written to {filepath}")
             else:
                 print("Invalid serialize type.")
                 status = 'DATA_ERROR: Invalid serialize type.'
         except OSError:
             status = 'DATA_ERROR: Could not write to file.'
+        except ParseError:
+            print("Could not parse the XML data.")
+            status = 'DATA_ERROR: Invalid XML'
+    timer.lap('output')
 
     return status
 
 
-def start_server(timeout: Union[int, None] = None) -> None:
+def process_message(config: dict,
+                    data: bytes,
+                    serv_conf: dict,
+                    key: rsa.PrivateKey,
+                    sessions: dict,
+                    decrypt_pool: Union[ProcessPoolExecutor, None] = None,
+                    timer: StageTimer = NULL_TIMER) -> str:
     """
-    Start the server.
+    Process a received message, rejecting messages with an unknown config id.
 
-    :param timeout: The timeout for the server.
+    Errors from invalid data or configs are returned as a DATA_ERROR status
+    with the type of the error, so the client gets a response and the
+    connection is kept.
+
+    :param config: The dictionary of config.
+    :param data: The received data.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param sessions: The session keys of the connection, by session id.
+    :param decrypt_pool: The process pool to decrypt RSA blocks with.
+    :param timer: The timer of the message stages.
+    :return: The status message.
+    """
+    if 'type' not in config:
+        return 'DATA_ERROR: Unknown config_id'
+    try:
+        return process_recv_data(config, data, serv_conf, priv_key=key, sessions=sessions,
+                                 decrypt_pool=decrypt_pool, timer=timer)
+    except Exception as error:
+        print(f"Could not process the data: {error!r}")
+        return f'DATA_ERROR: {type(error).__name__}'
+
+
+class Pipeline:
+    """
+    Pipelined messages of a connection.
+
+    Messages with a sequence number are processed by worker threads while the
+    next messages are received, and each is acknowledged with a JSON response
+    {"seq": ..., "status": ...} as soon as it is processed, so acknowledgements
+    may arrive out of order.
+    """
+
+    def __init__(self, conn: socket.socket, workers: int = 4, window: int = 64) -> None:
+        """
+        Start the worker threads of the pipeline.
+
+        :param conn: The client connection to acknowledge the messages on.
+        :param workers: The number of worker threads.
+        :param window: The maximum number of messages in flight, receiving blocks above it.
+        """
+        self.conn = conn
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.send_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(window)
+        self.futures = set()
+
+    def submit(self, config: dict, data: bytes, *args, timer: StageTimer = NULL_TIMER) -> None:
+        """
+        Process a message in a worker thread and acknowledge it.
+
+        :param config: The dictionary of config with the sequence number.
+        :param data: The received data.
+        :param args: The other arguments of process_message.
+        :param timer: The timer of the message stages.
+        :return: None.
+        """
+        self.slots.acquire()
+        future = self.executor.submit(self.acknowledge, config, data, *args, timer=timer)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+
+    def acknowledge(self, config: dict, data: bytes, *args, timer: StageTimer = NULL_TIMER) -> None:
+        """
+        Process a message and send its acknowledgement.
+
+        :param config: The dictionary of config with the sequence number.
+        :param data: The received data.
+        :param args: The other arguments of process_message.
+        :param timer: The timer of the message stages.
+        :return: None.
+        """
+        try:
+            timer.lap('queue')
+            status_msg = process_message(config, data, *args, timer=timer)
+            with self.send_lock:
+                send_response(self.conn, json.dumps({'seq': config['seq'], 'status': status_msg}))
+            timer.lap('send')
+            timer.finish(config)
+        except (SystemExit, Exception) as error:
+            # The client waits for every acknowledgement, so it is stopped instead of hanging
+            print(f"Could not acknowledge message {config['seq']}: {error!r}")
+            shutdown_connections([self.conn], socket.SHUT_RDWR)
+        finally:
+            self.slots.release()
+
+    def wait(self) -> None:
+        """
+        Wait until every message in flight is acknowledged.
+
+        :return: None.
+        """
+        for future in list(self.futures):
+            future.exception()
+
+    def close(self) -> None:
+        """
+        Acknowledge the messages in flight and stop the worker threads.
+
+        :return: None.
+        """
+        self.executor.shutdown(wait=True)
+
+
+def handle_connection(conn: socket.socket,
+                      addr: tuple,
+                      serv_conf: dict,
+                      key: rsa.PrivateKey,
+                      timeout: Union[int, None] = None,
+                      decrypt_pool: Union[ProcessPoolExecutor, None] = None,
+                      pipeline_workers: int = 4) -> None:
+    """
+    Serve a single client connection until the client stops.
+
+    :param conn: The client connection.
+    :param addr: The address of the client.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param timeout: The timeout for the connection.
+    :param decrypt_pool: The process pool to decrypt RSA blocks with.
+    :param pipeline_workers: The number of threads processing pipelined messages.
     :return: None.
     """
-    # Get server configuration
-    host, port = network_config()
-    sock = initialize_server(host, port)
-    serv_conf = server_config()
-    key = get_private_key()
-    print("------------Start Connection------------")
-    conn, addr = sock.accept()
     conn.settimeout(timeout)  # Set the timeout for the connection
+    # Session keys are decrypted once and reused for the whole connection
+    sessions = {}
+    # Configs of config sessions, so later messages only send the config id
+    configs = {}
+    # Started by the first pipelined message
+    pipeline = None
+    # The stages of the messages are only timed with latency statistics
+    stats = serv_conf.get('stats')
     try:
         with conn:
             cont = 1
             while cont > 0:
+                timer = stats.timer() if stats is not None else NULL_TIMER
                 # Get client configuration
-                config = receive_config(conn, addr)
+                config = receive_config(conn, addr, configs=configs, timer=timer)
+                if config is None:
+                    break
+                if config.get('type') == 3:
+                    if pipeline is not None:
+                        pipeline.wait()
+                    # Files are received straight into their output file
+                    status_msg = receive_file(conn, config, serv_conf)
+                    timer.lap('recv_file')
+                    send_response(conn, status_msg)
+                    timer.lap('send')
+                    timer.finish(config)
+                    if 'config_id' not in config:
+                        cont = int(receive_data(conn).decode('utf-8'))
+                    continue
                 # Get client data
                 data = receive_data(conn)
+                timer.lap('recv_data')
+                if 'seq' in config:
+                    # Pipelined messages are acknowledged by sequence number when processed
+                    if pipeline is None:
+                        pipeline = Pipeline(conn, workers=pipeline_workers)
+                    pipeline.submit(config, data, serv_conf, key, sessions, decrypt_pool,
+                                    timer=timer)
+                    if 'session_key' in config:
+                        # The next messages of the session need the key this one opens
+                        pipeline.wait()
+                    continue
+                if pipeline is not None:
+                    # Lock-step responses are only sent when no acknowledgement is pending
+                    pipeline.wait()
+                    timer.lap('queue')
                 # Process data
-                status_msg = process_recv_data(
-                    config, data, serv_conf, priv_key=key)
+                status_msg = process_message(config, data, serv_conf, key, sessions, decrypt_pool,
+                                             timer=timer)
                 # Send status message
                 send_response(conn, status_msg)
-                # Check if the client wants to continue
-                cont = int(receive_data(conn).decode('utf-8'))
+                timer.lap('send')
+                timer.finish(config)
+                # Check if the client wants to continue, config sessions continue until ended
+                if 'config_id' not in config:
+                    cont = int(receive_data(conn).decode('utf-8'))
     except socket.timeout:
         print("Connection timed out.")
     except ConnectionError:
         print("Connection Error.")
+    finally:
+        if pipeline is not None:
+            pipeline.close()
+
+
+def serve_client(conn: socket.socket,
+                 addr: tuple,
+                 serv_conf: dict,
+                 key: rsa.PrivateKey,
+                 timeout: Union[int, None] = None,
+                 decrypt_pool: Union[ProcessPoolExecutor, None] = None) -> None:
+    """
+    Serve a client connection from a worker thread.
+
+    The receive and send functions exit on repeated errors, and invalid
+    messages can raise outside processing, which would silently end the
+    worker thread, so the error is reported and the worker is returned to
+    the pool instead.
+
+    :param conn: The client connection.
+    :param addr: The address of the client.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param timeout: The timeout for the connection.
+    :param decrypt_pool: The process pool to decrypt RSA blocks with.
+    :return: None.
+    """
+    try:
+        handle_connection(conn, addr, serv_conf, key, timeout=timeout,
+                          decrypt_pool=decrypt_pool)
+    except (SystemExit, Exception) as error:
+        print(f"Connection with {addr} closed after an error: {error!r}")
+        conn.close()
+
+
+def shutdown_connections(connections: list, how: int) -> None:
+    """
+    Shut down client connections, ignoring the ones already closed.
+
+    :param connections: The client connections.
+    :param how: socket.SHUT_RD to stop receiving, socket.SHUT_RDWR to also stop sending.
+    :return: None.
+    """
+    for conn in connections:
+        try:
+            conn.shutdown(how)
+        except OSError:
+            pass
+
+
+def serve_forever(sock: socket.socket,
+                  serv_conf: dict,
+                  key: rsa.PrivateKey,
+                  workers: int = 4,
+                  timeout: Union[int, None] = None,
+                  stop_event: Union[threading.Event, None] = None,
+                  poll_interval: float = 0.5,
+                  decrypt_pool: Union[ProcessPoolExecutor, None] = None,
+                  drain_timeout: Union[float, None] = None) -> None:
+    """
+    Accept connections continuously and serve them concurrently.
+
+    :param sock: The listening server socket.
+    :param serv_conf: The server configuration.
+    :param key: The private key.
+    :param workers: The number of connections served at the same time.
+    :param timeout: The timeout for each connection.
+    :param stop_event: Set to stop accepting connections.
+    :param poll_interval: The seconds between checks of the stop event.
+    :param decrypt_pool: The process pool to decrypt RSA blocks with.
+    :param drain_timeout: The seconds to wait for clients to close their connections
+        after the stop, before they stop receiving, or None to wait for the clients.
+    :return: None.
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    sock.settimeout(poll_interval)
+    # The open connections, by the future serving them
+    connections = {}
+    # Leaving the executor waits for the connections being served
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while not stop_event.is_set():
+                try:
+                    conn, addr = sock.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    # The listening socket was closed
+                    break
+                print('Accepted connection from', addr)
+                future = pool.submit(serve_client, conn, addr, serv_conf, key, timeout,
+                                     decrypt_pool)
+                connections[future] = conn
+                future.add_done_callback(lambda done: connections.pop(done, None))
+            if drain_timeout is not None:
+                wait(list(connections), timeout=drain_timeout)
+                # Messages already received are still processed and acknowledged
+                shutdown_connections(list(connections.values()), socket.SHUT_RD)
+        except KeyboardInterrupt:
+            # The workers blocked in recv are woken up, so leaving the executor does not hang
+            shutdown_connections(list(connections.values()), socket.SHUT_RDWR)
+            raise
+
+
+def start_server(timeout: Union[int, None] = None) -> None:
+    """
+    Start the server.
+
+    :param timeout: The timeout for the server.
+    :return: None.
+    """
+    # Get server configuration
+    host, port = network_config()
+    sock = initialize_server(host, port)
+    serv_conf = server_config()
+    key = get_private_key()
+    if key != '':
+        # Precompute the private key values once for the lifetime of the server
+        key = DecryptContext(key)
+    print("------------Start Connection------------")
+    conn, addr = sock.accept()
+    handle_connection(conn, addr, serv_conf, key, timeout=timeout)
     sock.close()
     print("Server closed.")
 
 
+def start_concurrent_server(timeout: Union[int, None] = None,
+                            workers: int = 4,
+                            backlog: int = 16,
+                            decrypt_workers: int = 0) -> None:
+    """
+    Start the server and serve clients concurrently until interrupted.
+
+    :param timeout: The timeout for each connection.
+    :param workers: The number of connections served at the same time.
+    :param backlog: The backlog of the socket.
+    :param decrypt_workers: The number of processes decrypting RSA blocks, 0 to decrypt in threads.
+    :return: None.
+    """
+    # Get server configuration
+    host, port = network_config()
+    sock = initialize_server(host, port, backlog=backlog)
+    serv_conf = server_config()
+    key = get_private_key()
+    if key != '':
+        # Precompute the private key values once for the lifetime of the server
+        key = DecryptContext(key)
+    print("------------Start Connection------------")
+    stop_event = threading.Event()
+    decrypt_pool = None
+    if decrypt_workers > 0 and key != '':
+        decrypt_pool = start_decrypt_pool(key, workers=decrypt_workers)
+    try:
+        serve_forever(sock, serv_conf, key, workers=workers, timeout=timeout,
+                      stop_event=stop_event, decrypt_pool=decrypt_pool)
+    except KeyboardInterrupt:
+        stop_event.set()
+    if decrypt_pool is not None:
+        decrypt_pool.shutdown()
+    sock.close()
+    print("Server closed.")
+
+
+def parse_args(argv: Union[list, None] = None) -> argparse.Namespace:
+    """
+    Parse the command line options of the headless server.
+
+    :param argv: The command line arguments, defaults to sys.argv.
+    :return: The parsed options.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m cs_network',
+        description="Serve clients without prompts until SIGTERM or SIGINT.")
+    parser.add_argument('--host', default=socket.gethostname(), help="The host to bind to.")
+    parser.add_argument('--port', type=int, default=50541, help="The port to bind to.")
+    parser.add_argument('--output-dir',
+                        help="The folder to write the received data to, "
+                        "the data is printed to the console if omitted.")
+    parser.add_argument('--prefix', default='server_output',
+                        help="The filename prefix of the output files.")
+    parser.add_argument('--log', action='store_true',
+                        help="Append the received data to segment files of a log in the output "
+                        "folder, instead of writing one file for each message.")
+    parser.add_argument('--segment-mb', type=int, default=64,
+                        help="The size in MiB above which a new log segment is started.")
+    parser.add_argument('--segment-seconds', type=float, default=3600,
+                        help="The age in seconds above which a new log segment is started.")
+    parser.add_argument('--key', help="The private key .pem file, defaults to the example key.")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="The number of connections served at the same time.")
+    parser.add_argument('--decrypt-workers', type=int, default=0,
+                        help="The number of processes decrypting RSA blocks, "
+                        "0 to decrypt in threads.")
+    parser.add_argument('--backlog', type=int, default=16, help="The backlog of the socket.")
+    parser.add_argument('--timeout', type=float, help="The timeout for each connection.")
+    parser.add_argument('--drain-timeout', type=float, default=30,
+                        help="The seconds to wait for clients to finish after SIGTERM.")
+    parser.add_argument('--stats', action='store_true',
+                        help="Time the stages of the messages, the latency percentiles are "
+                        "printed on SIGUSR1 and when the server stops.")
+    return parser.parse_args(argv)
+
+
+def run_daemon(args: argparse.Namespace) -> None:
+    """
+    Serve clients with the command line options until SIGTERM or SIGINT.
+
+    On the signal, the server stops accepting connections, and waits for the
+    messages in flight to be processed and acknowledged before exiting.
+    With the stats option, SIGUSR1 prints the latency of each stage.
+
+    :param args: The options from parse_args.
+    :return: None.
+    """
+    if args.output_dir is None:
+        serv_conf = {'output_method': 2, 'filepath': None}
+    elif isdir(args.output_dir):
+        serv_conf = {'output_method': 1, 'filepath': join(args.output_dir, args.prefix)}
+    else:
+        print(f"Output folder {args.output_dir} not found.")
+        sys.exit(1)
+    if args.log and args.output_dir is None:
+        print("The log needs an output folder.")
+        sys.exit(1)
+    if args.log:
+        serv_conf['sink'] = SegmentLog(serv_conf['filepath'],
+                                       segment_bytes=args.segment_mb << 20,
+                                       segment_seconds=args.segment_seconds)
+    if args.stats:
+        serv_conf['stats'] = LatencyStats()
+    # The key is loaded and precomputed before accepting any connection
+    key = DecryptContext(load_priv_key_cached(args.key) if args.key else get_example_priv_key())
+    sock = initialize_server(args.host, args.port, backlog=args.backlog)
+    stop_event = threading.Event()
+
+    def stop(signum: int, _frame) -> None:
+        print(f"Received {signal.Signals(signum).name}, draining connections.")
+        stop_event.set()
+
+    def report(_signum: int, _frame) -> None:
+        print(serv_conf['stats'].report())
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if args.stats and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, report)
+    decrypt_pool = None
+    if args.decrypt_workers > 0:
+        decrypt_pool = start_decrypt_pool(key, workers=args.decrypt_workers)
+    try:
+        serve_forever(sock, serv_conf, key, workers=args.workers, timeout=args.timeout,
+                      stop_event=stop_event, decrypt_pool=decrypt_pool,
+                      drain_timeout=args.drain_timeout)
+    finally:
+        if decrypt_pool is not None:
+            decrypt_pool.shutdown()
+        if 'sink' in serv_conf:
+            serv_conf['sink'].close()
+        if 'stats' in serv_conf:
+            print(serv_conf['stats'].report())
+        sock.close()
+    print("Server closed.")
+
+
 if __name__ == "__main__":
-    start_server()
+    # python -m cs_network is the entry point, this module is also imported by the package
+    if len(sys.argv) > 1:
+        run_daemon(parse_args())
+    else:
+        start_server()
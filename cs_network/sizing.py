@@ -0,0 +1,113 @@
+"""Serialized size of a dictionary, updated as its keys are added."""
+import json
+import pickle
+from typing import Union
+from cs_network.binary import packb
+from cs_network.xmlstream import iter_xml
+
+# Sizes of the parts of a pickled dictionary around its entries
+PICKLE_EMPTY = len(pickle.dumps({}))
+PICKLE_FRAME = 9
+PICKLE_FRAME_SIZE = 1 << 16
+PICKLE_BATCH = 1000
+XML_EMPTY = len(b''.join(iter_xml({})))
+XML_TAGS = len(b'<root></root>')
+
+
+class SizeEstimator:
+    """
+    Serialized size of a dictionary, updated as its keys are added or replaced.
+
+    Only the new entry is serialized on each update, so sizing a dictionary
+    of N keys costs O(N) instead of serializing the whole dictionary for
+    every key. The sizes are exact, except the binary size, which is an upper
+    bound when objects, like one-character strings, are shared between entries,
+    and may be off by a frame header near the 64 KiB pickle frame boundaries.
+    """
+
+    def __init__(self, serialize: int, data: Union[dict, None] = None) -> None:
+        """
+        Start tracking the size of a dictionary.
+
+        :param serialize: The serialization method, 1 binary, 2 JSON, 3 XML or 4 MessagePack.
+        :param data: The initial dictionary.
+        """
+        self.serialize = serialize
+        self.entries = {}
+        self.total = 0
+        for key, value in (data or {}).items():
+            self.add(key, value)
+
+    def entry_size(self, key: str, value: object) -> int:
+        """
+        Get the serialized size of one entry.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        :return: The size in bytes.
+        """
+        if self.serialize == 1:
+            return len(pickle.dumps({key: value})) - PICKLE_EMPTY - PICKLE_FRAME - 1
+        if self.serialize == 2:
+            return len(json.dumps({key: value}).encode('utf-8')) - 2
+        if self.serialize == 3:
+            return len(b''.join(iter_xml({key: value}))) - XML_TAGS
+        if self.serialize == 4:
+            return len(packb({key: value})) - 1
+        raise ValueError("Invalid serialize type.")
+
+    def size_with(self, count: int, total: int) -> int:
+        """
+        Get the serialized size of a dictionary from its entries.
+
+        :param count: The number of entries.
+        :param total: The sum of the sizes of the entries.
+        :return: The size in bytes.
+        """
+        if self.serialize == 1:
+            if count == 0:
+                return PICKLE_EMPTY
+            # A single item is set with SETITEM, more items with MARK and SETITEMS
+            # for every batch, and one more for the batch after the last full batch
+            setitems = 1 if count == 1 else 2 * (count // PICKLE_BATCH + 1)
+            size = PICKLE_EMPTY + total + setitems
+            return size + PICKLE_FRAME * (1 + size // PICKLE_FRAME_SIZE)
+        if self.serialize == 2:
+            return 2 + total + 2 * max(count - 1, 0)
+        if self.serialize == 3:
+            return XML_TAGS + total if count else XML_EMPTY
+        # MessagePack maps start with a 1, 3 or 5 byte header
+        return total + (1 if count < 16 else 3 if count <= 0xffff else 5)
+
+    def size(self) -> int:
+        """
+        Get the serialized size of the dictionary.
+
+        :return: The size in bytes.
+        """
+        return self.size_with(len(self.entries), self.total)
+
+    def size_after(self, key: str, value: object) -> int:
+        """
+        Get the serialized size the dictionary would have with an entry set.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        :return: The size in bytes.
+        """
+        count = len(self.entries) + (key not in self.entries)
+        total = self.total - self.entries.get(key, 0) + self.entry_size(key, value)
+        return self.size_with(count, total)
+
+    def add(self, key: str, value: object) -> int:
+        """
+        Set an entry, replacing the entry with the same key.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        :return: The serialized size of the dictionary.
+        """
+        entry_size = self.entry_size(key, value)
+        self.total += entry_size - self.entries.get(key, 0)
+        self.entries[key] = entry_size
+        return self.size()
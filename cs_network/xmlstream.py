@@ -0,0 +1,195 @@
+"""Incremental XML writer and pull-parser based reader for dictionaries."""
+from itertools import repeat
+from typing import Callable, Iterator, Union
+from xml.etree.ElementTree import XMLPullParser, tostring
+from xml.sax.saxutils import escape
+
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>'
+# Number of characters written or parsed at a time
+CHUNK_SIZE = 1 << 16
+# Quotes are escaped in text and attributes, as xml.dom.minidom does
+QUOTE_ENTITIES = {'"': '&quot;'}
+
+
+def iter_xml(dict_val: dict,
+             root_tag: str = 'root',
+             chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Convert a dictionary to XML in chunks, without building the whole document.
+
+    Nested dictionaries are written with an explicit stack instead of recursion,
+    so the depth of the dictionary is not limited by the recursion limit.
+    Each item of a list or tuple is written as an element with the tag of its key.
+
+    :param dict_val: The dictionary to convert.
+    :param root_tag: The root tag of the XML.
+    :param chunk_size: The approximate number of characters in each chunk.
+    :return: An iterator of UTF-8 encoded chunks.
+    """
+    if not dict_val:
+        yield f'<{root_tag} />'.encode('utf-8')
+        return
+    parts = [f'<{root_tag}>']
+    append = parts.append
+    size = 0
+    # The closing tags and the remaining items of the open elements, lists have
+    # no closing tag as their items are written in the parent element
+    closing = [f'</{root_tag}>']
+    stack = [iter(dict_val.items())]
+    while stack:
+        for key, value in stack[-1]:
+            if type(value) is str:
+                text = value
+            elif isinstance(value, dict):
+                if value:
+                    append(f'<{key}>')
+                    closing.append(f'</{key}>')
+                    stack.append(iter(value.items()))
+                    break
+                text = ''
+            elif isinstance(value, (list, tuple)):
+                if value:
+                    closing.append('')
+                    stack.append(zip(repeat(key), value))
+                    break
+                text = ''
+            else:
+                text = str(value)
+            if not text:
+                part = f'<{key} />'
+            else:
+                # Most values have nothing to escape
+                if '&' in text or '<' in text or '>' in text:
+                    text = escape(text)
+                part = f'<{key}>{text}</{key}>'
+            append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(parts).encode('utf-8')
+                parts.clear()
+                size = 0
+        else:
+            stack.pop()
+            append(closing.pop())
+    yield ''.join(parts).encode('utf-8')
+
+
+def write_xml(dict_val: dict,
+              write: Callable[[bytes], object],
+              root_tag: str = 'root',
+              chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Write a dictionary as XML, such as to a file or a socket.
+
+    :param dict_val: The dictionary to convert.
+    :param write: The function writing each chunk of bytes.
+    :param root_tag: The root tag of the XML.
+    :param chunk_size: The approximate number of characters in each chunk.
+    :return: None.
+    """
+    for chunk in iter_xml(dict_val, root_tag, chunk_size):
+        write(chunk)
+
+
+def iter_events(data: Union[str, bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Parse XML in chunks and generate the start and end events of its elements.
+
+    :param data: The XML.
+    :param chunk_size: The number of characters or bytes parsed at a time.
+    :return: An iterator of (event, element) tuples.
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    for offset in range(0, len(data), chunk_size):
+        parser.feed(data[offset:offset + chunk_size])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def start_tag(elem) -> str:
+    """
+    Format the start tag of an element with its attributes.
+
+    :param elem: The element.
+    :return: The start tag, without the closing bracket.
+    """
+    attrs = ''.join(f' {name}="{escape(value, QUOTE_ENTITIES)}"'
+                    for name, value in elem.attrib.items())
+    return f'<{elem.tag}{attrs}'
+
+
+def write_pretty_xml(data: Union[str, bytes],
+                     write: Callable[[str], object],
+                     indent: str = '\t',
+                     chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Write XML indented as xml.dom.minidom toprettyxml does, while it is parsed.
+
+    Finished elements are removed from the parsed tree, so only the open
+    elements are kept in memory.
+
+    :param data: The XML.
+    :param write: The function writing each string.
+    :param indent: The indentation of each level.
+    :param chunk_size: The number of characters or bytes parsed at a time.
+    :return: None.
+    """
+    # The lines are written in batches to save calls to write
+    out = [XML_DECLARATION]
+    stack = []
+    # The element whose start tag is not written yet, it is written
+    # with its text on one line if it has no children
+    pending = None
+    # The last closed element, whose tail text is written before the next tag
+    closed = None
+    for event, elem in iter_events(data, chunk_size):
+        if closed is not None and closed.tail and closed.tail.strip():
+            out.append(f'\n{indent * len(stack)}{escape(closed.tail, QUOTE_ENTITIES)}')
+        closed = None
+        if event == 'start':
+            if pending is not None:
+                out.append(f'\n{indent * (len(stack) - 1)}{start_tag(pending)}>')
+                if pending.text and pending.text.strip():
+                    out.append(f'\n{indent * len(stack)}{escape(pending.text, QUOTE_ENTITIES)}')
+            stack.append(elem)
+            pending = elem
+            continue
+        depth = len(stack) - 1
+        if pending is elem and elem.text:
+            out.append(f'\n{indent * depth}{start_tag(elem)}>'
+                       f'{escape(elem.text, QUOTE_ENTITIES)}</{elem.tag}>')
+        elif pending is elem:
+            out.append(f'\n{indent * depth}{start_tag(elem)}/>')
+        else:
+            out.append(f'\n{indent * depth}</{elem.tag}>')
+        pending = None
+        closed = stack.pop()
+        if stack:
+            stack[-1].remove(elem)
+        if len(out) >= 1024:
+            write(''.join(out))
+            out = []
+    write(''.join(out))
+
+
+def iter_children(data: Union[str, bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Generate the XML of each child of the root element, while it is parsed.
+
+    :param data: The XML.
+    :param chunk_size: The number of characters or bytes parsed at a time.
+    :return: An iterator of XML strings.
+    """
+    root = None
+    depth = 0
+    for event, elem in iter_events(data, chunk_size):
+        if event == 'start':
+            root = elem if root is None else root
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            elem.tail = None
+            yield tostring(elem, encoding='unicode')
+            root.remove(elem)
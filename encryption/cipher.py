@@ -1,8 +1,22 @@
 """Functions to encrypt and decrypt messages with a public and private key."""
+import os
+import hmac
+import hashlib
+from functools import lru_cache
+from typing import Union, Iterable, Iterator
 import rsa
+from .context import DecryptContext
 
+SESSION_KEY_SIZE = 32
+NONCE_SIZE = 16
+TAG_SIZE = 32
+# Number of bytes XORed with each keystream
+KEYSTREAM_CHUNK_SIZE = 1 << 20
+# PKCS#1 v1.5 padding takes 11 bytes of every RSA block
+PADDING_SIZE = 11
 
-def encrypt(message: str, public_key: rsa.PublicKey) -> bytes:
+
+def encrypt(message: Union[str, bytes], public_key: rsa.PublicKey) -> bytes:
     """
     Encrypt a message with a public key.
 
@@ -13,10 +27,25 @@ def encrypt(message: str, public_key: rsa.PublicKey) -> bytes:
     :param public_key: The public key to encrypt with.
     :return: The encrypted message.
     """
-    return rsa.encrypt(message.encode('utf8'), public_key)
+    if isinstance(message, str):
+        message = message.encode('utf8')
+    return rsa.encrypt(message, public_key)
+
 
+def rsa_decrypt(block: bytes, private_key: Union[rsa.PrivateKey, DecryptContext]) -> bytes:
+    """
+    Decrypt a single RSA block with a private key or a decryption context.
 
-def decrypt(data_bytes: bytes, private_key: rsa.PrivateKey) -> str:
+    :param block: The encrypted block.
+    :param private_key: The private key, or a DecryptContext for repeated decryption.
+    :return: The decrypted block.
+    """
+    if isinstance(private_key, DecryptContext):
+        return private_key.decrypt(block)
+    return rsa.decrypt(block, private_key)
+
+
+def decrypt(data_bytes: bytes, private_key: Union[rsa.PrivateKey, DecryptContext]) -> str:
     """
     Decrypt a message with a private key.
 
@@ -24,10 +53,248 @@ def decrypt(data_bytes: bytes, private_key: rsa.PrivateKey) -> str:
     So string is required to be decoded.
 
     :param data_bytes: The message in bytes to decrypt.
-    :param private_key: The private key to decrypt with.
+    :param private_key: The private key, or a DecryptContext for repeated decryption.
     :return: The decrypted message.
     """
-    return rsa.decrypt(data_bytes, private_key)
+    return rsa_decrypt(data_bytes, private_key)
+
+
+def max_message_size(public_key: rsa.PublicKey) -> int:
+    """
+    Get the largest message that fits in a single RSA block.
+
+    :param public_key: The public key to encrypt with.
+    :return: The maximum message size in bytes.
+    """
+    return rsa.common.byte_size(public_key.n) - PADDING_SIZE
+
+
+def encrypted_stream_size(size: int, public_key: rsa.PublicKey) -> int:
+    """
+    Get the size of a message of the given size encrypted with encrypt_stream.
+
+    :param size: The size of the message in bytes.
+    :param public_key: The public key to encrypt with.
+    :return: The size of the encrypted message in bytes.
+    """
+    blocks = -(-size // max_message_size(public_key))
+    return blocks * rsa.common.byte_size(public_key.n)
+
+
+def iter_blocks(chunks: Iterable[bytes], block_size: int) -> Iterator[bytes]:
+    """
+    Regroup chunks of any size into blocks of block_size bytes.
+
+    The last block may be shorter.
+
+    :param chunks: The chunks of bytes.
+    :param block_size: The size of the blocks.
+    :return: An iterator of blocks.
+    """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        end = len(buffer) - len(buffer) % block_size
+        for start in range(0, end, block_size):
+            yield buffer[start:start + block_size]
+        buffer = buffer[end:]
+    if buffer:
+        yield buffer
+
+
+def encrypt_stream(chunks: Iterable[bytes], public_key: rsa.PublicKey) -> Iterator[bytes]:
+    """
+    Encrypt a stream of bytes with a public key, one RSA block at a time.
+
+    Only one chunk and one block are held in memory,
+    whatever the size of the message.
+
+    :param chunks: The chunks of the message to encrypt.
+    :param public_key: The public key to encrypt with.
+    :return: An iterator of encrypted blocks.
+    """
+    for block in iter_blocks(chunks, max_message_size(public_key)):
+        yield rsa.encrypt(block, public_key)
+
+
+def decrypt_stream(chunks: Iterable[bytes],
+                   private_key: Union[rsa.PrivateKey, DecryptContext]) -> Iterator[bytes]:
+    """
+    Decrypt a stream encrypted with encrypt_stream, one RSA block at a time.
+
+    :param chunks: The chunks of the encrypted message.
+    :param private_key: The private key, or a DecryptContext for repeated decryption.
+    :return: An iterator of decrypted blocks.
+    """
+    for block in iter_blocks(chunks, rsa.common.byte_size(private_key.n)):
+        yield rsa_decrypt(block, private_key)
+
+
+def generate_session_key() -> bytes:
+    """
+    Generate a random key for symmetric encryption.
+
+    :return: The session key.
+    """
+    return os.urandom(SESSION_KEY_SIZE)
+
+
+def derive_key(key: bytes, info: bytes) -> bytes:
+    """
+    Derive a subkey from a session key with HKDF-SHA256 (RFC 5869).
+
+    :param key: The session key.
+    :param info: The purpose of the subkey, a different purpose gives an independent subkey.
+    :return: The 32-byte subkey.
+    """
+    prk = hmac.digest(bytes(32), key, 'sha256')
+    return hmac.digest(prk, info + b'\x01', 'sha256')
+
+
+@lru_cache(maxsize=256)
+def session_subkeys(key: bytes) -> tuple:
+    """
+    Derive the encryption and MAC keys of a session key, once for every session.
+
+    :param key: The session key.
+    :return: The encryption key and the MAC key.
+    """
+    return derive_key(key, b'cs_network encrypt'), derive_key(key, b'cs_network mac')
+
+
+def iter_xor_keystream(data_bytes: bytes, key: bytes, nonce: bytes) -> Iterator[bytes]:
+    """
+    XOR the data with a SHAKE-256 keystream, one chunk at a time.
+
+    Each chunk has its own keystream derived from the key, nonce and chunk
+    number, so the keystream and integers stay small instead of spanning
+    the whole message.
+
+    :param data_bytes: The data to XOR.
+    :param key: The encryption key.
+    :param nonce: The nonce, unique for every message.
+    :return: An iterator of XORed chunks.
+    """
+    view = memoryview(data_bytes)
+    for counter, offset in enumerate(range(0, len(view), KEYSTREAM_CHUNK_SIZE)):
+        chunk = view[offset:offset + KEYSTREAM_CHUNK_SIZE]
+        size = len(chunk)
+        keystream = hashlib.shake_256(key + nonce + counter.to_bytes(8, 'big')).digest(size)
+        yield (int.from_bytes(chunk, 'little') ^
+               int.from_bytes(keystream, 'little')).to_bytes(size, 'little')
+
+
+def xor_keystream(data_bytes: bytes, key: bytes, nonce: bytes) -> bytes:
+    """
+    XOR the data with a SHAKE-256 keystream derived from the key and nonce.
+
+    Applying it twice with the same key and nonce returns the original data.
+
+    :param data_bytes: The data to XOR.
+    :param key: The encryption key.
+    :param nonce: The nonce, unique for every message.
+    :return: The XORed data.
+    """
+    return b''.join(iter_xor_keystream(data_bytes, key, nonce))
+
+
+def symmetric_encrypt(data_bytes: bytes, key: bytes) -> bytes:
+    """
+    Encrypt data with a session key.
+
+    The output is the nonce, the ciphertext and an HMAC-SHA256 tag
+    over the nonce and ciphertext. The keystream and the tag use separate
+    keys derived from the session key.
+
+    :param data_bytes: The data to encrypt.
+    :param key: The session key.
+    :return: The encrypted data.
+    """
+    encrypt_key, mac_key = session_subkeys(bytes(key))
+    nonce = os.urandom(NONCE_SIZE)
+    parts = [nonce]
+    mac = hmac.new(mac_key, nonce, 'sha256')
+    for chunk in iter_xor_keystream(data_bytes, encrypt_key, nonce):
+        mac.update(chunk)
+        parts.append(chunk)
+    parts.append(mac.digest())
+    return b''.join(parts)
+
+
+def symmetric_decrypt(data_bytes: bytes, key: bytes) -> bytes:
+    """
+    Decrypt data encrypted with symmetric_encrypt.
+
+    :param data_bytes: The data to decrypt.
+    :param key: The session key.
+    :return: The decrypted data.
+    """
+    if len(data_bytes) < NONCE_SIZE + TAG_SIZE:
+        raise rsa.pkcs1.DecryptionError("Decryption failed")
+    encrypt_key, mac_key = session_subkeys(bytes(key))
+    view = memoryview(data_bytes)
+    if not hmac.compare_digest(hmac.digest(mac_key, view[:-TAG_SIZE], 'sha256'),
+                               view[-TAG_SIZE:]):
+        raise rsa.pkcs1.DecryptionError("Decryption failed")
+    return xor_keystream(view[NONCE_SIZE:-TAG_SIZE], encrypt_key, bytes(view[:NONCE_SIZE]))
+
+
+def hybrid_encrypt(message: Union[str, bytes], public_key: rsa.PublicKey) -> bytes:
+    """
+    Encrypt a message of any size with a public key.
+
+    A random session key is encrypted with RSA once,
+    and the message is encrypted with the session key.
+
+    :param message: The message to encrypt.
+    :param public_key: The public key to encrypt with.
+    :return: The encrypted session key followed by the encrypted message.
+    """
+    if isinstance(message, str):
+        message = message.encode('utf8')
+    session_key = generate_session_key()
+    return rsa.encrypt(session_key, public_key) + symmetric_encrypt(message, session_key)
+
+
+def hybrid_decrypt(data_bytes: bytes,
+                   private_key: Union[rsa.PrivateKey, DecryptContext]) -> bytes:
+    """
+    Decrypt a message encrypted with hybrid_encrypt.
+
+    :param data_bytes: The message in bytes to decrypt.
+    :param private_key: The private key, or a DecryptContext for repeated decryption.
+    :return: The decrypted message.
+    """
+    key_size = rsa.common.byte_size(private_key.n)
+    session_key = rsa_decrypt(bytes(data_bytes[:key_size]), private_key)
+    return symmetric_decrypt(data_bytes[key_size:], session_key)
+
+
+def new_session(public_key: rsa.PublicKey) -> dict:
+    """
+    Create a session key and encrypt it with the public key once.
+
+    :param public_key: The public key to encrypt the session key with.
+    :return: The session dictionary with the id, key and encrypted key.
+    """
+    session_key = generate_session_key()
+    wrapped_key = rsa.encrypt(session_key, public_key)
+    return {'id': hashlib.sha256(wrapped_key).hexdigest()[:32],
+            'key': session_key,
+            'wrapped_key': wrapped_key,
+            'public_key': public_key}
+
+
+def open_session(wrapped_key: bytes,
+                 private_key: Union[rsa.PrivateKey, DecryptContext]) -> bytes:
+    """
+    Decrypt a session key created with new_session.
+
+    :param wrapped_key: The encrypted session key.
+    :param private_key: The private key, or a DecryptContext for repeated decryption.
+    :return: The session key.
+    """
+    return rsa_decrypt(wrapped_key, private_key)
 
 
 if __name__ == "__main__":
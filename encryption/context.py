@@ -0,0 +1,97 @@
+"""Private key context with precomputed values for repeated decryption."""
+import math
+import threading
+from hmac import compare_digest
+import rsa
+
+
+class DecryptContext:
+    """
+    Private key with precomputed CRT and blinding values.
+
+    The CRT exponents, the CRT coefficient and the key size are computed once.
+    Each thread keeps its own blinding factor already raised to the public
+    exponent, and updates it by squaring instead of computing a new one.
+    """
+
+    def __init__(self, private_key: rsa.PrivateKey, blinding: bool = True) -> None:
+        """
+        Precompute the values of a private key.
+
+        :param private_key: The private key to decrypt with.
+        :param blinding: Whether to blind the messages against timing attacks.
+        """
+        self.private_key = private_key
+        self.blinding = blinding
+        self.n = private_key.n
+        self.e = private_key.e
+        self.p = private_key.p
+        self.q = private_key.q
+        self.exp1 = private_key.d % (self.p - 1)
+        self.exp2 = private_key.d % (self.q - 1)
+        self.coef = pow(self.q, -1, self.p)
+        self.key_size = rsa.common.byte_size(self.n)
+        self.local = threading.local()
+
+    def __reduce__(self) -> tuple:
+        """
+        Pickle the context as its private key, for process pools.
+
+        :return: The arguments to rebuild the context.
+        """
+        return (DecryptContext, (self.private_key, self.blinding))
+
+    def blinding_factors(self) -> tuple:
+        """
+        Get the blinding factor of this thread raised to the public exponent, and its inverse.
+
+        :return: The tuple of the blinding factor and its inverse.
+        """
+        factors = getattr(self.local, 'factors', None)
+        if factors is None:
+            blind_r = rsa.randnum.randint(self.n - 1)
+            while math.gcd(blind_r, self.n) != 1:
+                blind_r = rsa.randnum.randint(self.n - 1)
+            factors = (pow(blind_r, self.e, self.n), pow(blind_r, -1, self.n))
+        else:
+            # Squaring both keeps them inverse of each other
+            factors = (factors[0] * factors[0] % self.n,
+                       factors[1] * factors[1] % self.n)
+        self.local.factors = factors
+        return factors
+
+    def decrypt_int(self, encrypted: int) -> int:
+        """
+        Decrypt an integer with the Chinese Remainder Theorem.
+
+        :param encrypted: The encrypted integer.
+        :return: The decrypted integer.
+        """
+        if self.blinding:
+            blind_e, unblind = self.blinding_factors()
+            encrypted = encrypted * blind_e % self.n
+        s_1 = pow(encrypted, self.exp1, self.p)
+        s_2 = pow(encrypted, self.exp2, self.q)
+        decrypted = s_2 + self.q * ((s_1 - s_2) * self.coef % self.p)
+        if self.blinding:
+            decrypted = decrypted * unblind % self.n
+        return decrypted
+
+    def decrypt(self, crypto: bytes) -> bytes:
+        """
+        Decrypt a PKCS#1 v1.5 block, as rsa.decrypt does.
+
+        :param crypto: The encrypted block.
+        :return: The decrypted message.
+        """
+        if len(crypto) > self.key_size:
+            raise rsa.pkcs1.DecryptionError("Decryption failed")
+        encrypted = int.from_bytes(crypto, 'big')
+        if encrypted >= self.n:
+            raise rsa.pkcs1.DecryptionError("Decryption failed")
+        cleartext = self.decrypt_int(encrypted).to_bytes(self.key_size, 'big')
+        # The padding is at least 8 bytes after the 00 02 marker
+        sep_idx = cleartext.find(b'\x00', 2)
+        if not compare_digest(cleartext[:2], b'\x00\x02') or sep_idx < 10:
+            raise rsa.pkcs1.DecryptionError("Decryption failed")
+        return cleartext[sep_idx + 1:]
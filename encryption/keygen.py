@@ -2,14 +2,15 @@
 import rsa
 
 
-def generate_keys(keysize: int) -> tuple:
+def generate_keys(keysize: int, poolsize: int = 1) -> tuple:
     """
     Generate a key for encryption.
 
     :param keysize: The size of the key.
+    :param poolsize: The number of processes searching for primes.
     :return: A tuple containing the public and private keys.
     """
-    return rsa.newkeys(keysize)
+    return rsa.newkeys(keysize, poolsize=poolsize)
 
 
 def save_keys(public_key: rsa.PublicKey, private_key: rsa.PrivateKey, filename: str) -> None:
@@ -0,0 +1,106 @@
+"""Pool of key pairs generated ahead of time in the background."""
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Union
+from .keygen import generate_keys
+
+
+class KeyPool:
+    """
+    Pool of pre-generated key pairs, refilled in the background.
+
+    Key pairs are generated in worker processes. When poolsize is more than 1,
+    rsa.newkeys starts its own processes, so the workers are threads instead.
+    """
+
+    def __init__(self,
+                 keysize: int = 2048,
+                 size: int = 4,
+                 workers: Union[int, None] = None,
+                 poolsize: int = 1) -> None:
+        """
+        Start generating key pairs until the pool is full.
+
+        :param keysize: The size of the keys.
+        :param size: The number of key pairs kept ready.
+        :param workers: The number of key pairs generated at the same time.
+        :param poolsize: The number of processes rsa.newkeys uses for each key pair.
+        """
+        self.keysize = keysize
+        self.size = size
+        self.poolsize = poolsize
+        self.keys = queue.Queue()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.closed = False
+        if poolsize > 1:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.fill()
+
+    def __enter__(self) -> 'KeyPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def fill(self) -> None:
+        """
+        Start generating the key pairs missing from the pool.
+
+        :return: None.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            missing = self.size - self.keys.qsize() - self.pending
+            futures = []
+            for _ in range(missing):
+                self.pending += 1
+                futures.append(self.executor.submit(generate_keys, self.keysize, self.poolsize))
+        # A finished future runs its callback at once, which takes the lock
+        for future in futures:
+            future.add_done_callback(self.add_keys)
+
+    def add_keys(self, future: Future) -> None:
+        """
+        Add a generated key pair to the pool.
+
+        A failed generation is added in place of its key pair, so the caller
+        taking it gets the error and starts a new generation.
+
+        :param future: The finished key generation.
+        :return: None.
+        """
+        with self.lock:
+            self.pending -= 1
+        if not future.cancelled():
+            self.keys.put(future.exception() or future.result())
+
+    def get_keys(self, timeout: Union[float, None] = None) -> tuple:
+        """
+        Take a key pair from the pool, and start generating its replacement.
+
+        Waits for a key pair to be generated when the pool is empty.
+
+        :param timeout: The number of seconds to wait, or None to wait until one is ready.
+        :return: A tuple containing the public and private keys.
+        :raises Exception: The error of a failed key generation, its replacement is started.
+        """
+        keys = self.keys.get(timeout=timeout)
+        self.fill()
+        if isinstance(keys, BaseException):
+            raise keys
+        return keys
+
+    def close(self) -> None:
+        """
+        Stop generating key pairs.
+
+        :return: None.
+        """
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
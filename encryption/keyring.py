@@ -0,0 +1,62 @@
+"""Cache of keys loaded from files, keyed by file path and modification time."""
+import os
+import threading
+from typing import Callable
+import rsa
+from .keygen import load_pub_key, load_priv_key
+
+# Parsed keys by (absolute path, modification time, loader name)
+KEY_CACHE = {}
+CACHE_LOCK = threading.Lock()
+
+
+def load_key_cached(filename: str, loader: Callable) -> object:
+    """
+    Load a key from a file, parsing the file again only when it changes.
+
+    :param filename: The filename to load the key from.
+    :param loader: The function parsing the file, load_pub_key or load_priv_key.
+    :return: The key.
+    """
+    path = os.path.abspath(filename)
+    cache_key = (path, os.stat(path).st_mtime_ns, loader.__name__)
+    with CACHE_LOCK:
+        if cache_key in KEY_CACHE:
+            return KEY_CACHE[cache_key]
+    key = loader(path)
+    with CACHE_LOCK:
+        # Forget the key parsed from an older version of the file
+        for stale_key in [k for k in KEY_CACHE if k[0] == path and k[2] == cache_key[2]]:
+            del KEY_CACHE[stale_key]
+        KEY_CACHE[cache_key] = key
+    return key
+
+
+def load_pub_key_cached(filename: str) -> rsa.PublicKey:
+    """
+    Load a public key from a file through the key cache.
+
+    :param filename: The filename to load the key from.
+    :return: The public key.
+    """
+    return load_key_cached(filename, load_pub_key)
+
+
+def load_priv_key_cached(filename: str) -> rsa.PrivateKey:
+    """
+    Load a private key from a file through the key cache.
+
+    :param filename: The filename to load the key from.
+    :return: The private key.
+    """
+    return load_key_cached(filename, load_priv_key)
+
+
+def clear_key_cache() -> None:
+    """
+    Forget every cached key.
+
+    :return: None.
+    """
+    with CACHE_LOCK:
+        KEY_CACHE.clear()
@@ -0,0 +1,76 @@
+"""Functions to decrypt RSA blocks in parallel with a process pool."""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Union
+import rsa
+from .context import DecryptContext
+
+# The private key of each worker process, set once by the pool initializer
+WORKER_KEY = None
+
+
+def init_worker(private_key: Union[rsa.PrivateKey, DecryptContext]) -> None:
+    """
+    Store the decryption context of the private key in a worker process.
+
+    The key is sent to each worker once, instead of with every batch.
+
+    :param private_key: The private key, or a DecryptContext.
+    :return: None.
+    """
+    global WORKER_KEY
+    if not isinstance(private_key, DecryptContext):
+        private_key = DecryptContext(private_key)
+    WORKER_KEY = private_key
+
+
+def decrypt_batch(blocks: list) -> list:
+    """
+    Decrypt a batch of RSA blocks in a worker process.
+
+    :param blocks: The encrypted blocks.
+    :return: The decrypted blocks.
+    """
+    return [WORKER_KEY.decrypt(block) for block in blocks]
+
+
+def start_decrypt_pool(private_key: Union[rsa.PrivateKey, DecryptContext],
+                       workers: Union[int, None] = None) -> ProcessPoolExecutor:
+    """
+    Start a process pool for decryption.
+
+    :param private_key: The private key, or a DecryptContext.
+    :param workers: The number of worker processes, defaults to the number of CPUs.
+    :return: The process pool.
+    """
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=init_worker,
+                               initargs=(private_key,))
+
+
+def decrypt_many(pool: ProcessPoolExecutor,
+                 blocks: Iterable[bytes],
+                 batch_size: int = 32) -> list:
+    """
+    Decrypt RSA blocks or single-block messages in parallel.
+
+    Blocks are sent to the workers in batches to amortize the cost
+    of passing them between processes.
+
+    :param pool: The process pool from start_decrypt_pool.
+    :param blocks: The encrypted blocks.
+    :param batch_size: The number of blocks in each batch.
+    :return: The decrypted blocks, in order.
+    """
+    batches = []
+    batch = []
+    for block in blocks:
+        batch.append(bytes(block))
+        if len(batch) == batch_size:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+    decrypted = []
+    for result in pool.map(decrypt_batch, batches):
+        decrypted.extend(result)
+    return decrypted
@@ -2,3 +2,4 @@
 __version__ = "1.0.1"
 from .client_test import TestClient
 from .server_test import TestServer
+from .encryption_test import TestEncryption
@@ -8,9 +8,13 @@ from unittest import mock
 import json
 import os
 from os.path import dirname, join, abspath
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
 import rsa
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
-from cs_network import client
+from cs_network import client, dict_to_xml_string, SizeEstimator
+from cs_network.binary import packb
+from cs_network.functions import validate_xml_key, validate_xml_value, validate_xml_dict
 from encryption import EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY
 from tests import testcase
 
@@ -193,6 +197,70 @@ class TestClient(unittest.TestCase):
                     test['input_data'])
                 self.assertEqual(start_point, test['output_data'])
 
+    def test_size_estimator(self):
+        """Test that the size estimator matches the serialized size as keys are added."""
+        serializers = {1: pickle.dumps,
+                       2: lambda data: json.dumps(data).encode('utf-8'),
+                       3: dict_to_xml_string,
+                       4: packb}
+        for serialize, serializer in serializers.items():
+            with self.subTest(serialize=serialize):
+                sizes = SizeEstimator(serialize)
+                data = {}
+                self.assertEqual(sizes.size(), len(serializer(data)))
+                for num in range(20):
+                    key = f'key{num}'
+                    value = {f'nest{num}': f'value{num}'} if num % 5 == 0 else f'value{num}'
+                    self.assertEqual(sizes.size_after(key, value),
+                                     len(serializer(data | {key: value})))
+                    data[key] = value
+                    sizes.add(key, value)
+                # Large dictionaries are set in several batches and frames
+                for num in range(20, 3000):
+                    data[f'key{num}'] = f'value{num}' * 5
+                    sizes.add(f'key{num}', data[f'key{num}'])
+                self.assertEqual(sizes.size(), len(serializer(data)))
+                # Replacing a key replaces its size
+                data['key1'] = 'replaced'
+                sizes.add('key1', 'replaced')
+                self.assertEqual(sizes.size(), len(serializer(data)))
+
+    def test_xml_validation(self):
+        """Test that XML keys and values are validated as the XML parser does."""
+        for key in ('a', 'a-b.c_1', '_a', 'é', 'a·', '1a', '-a', 'a b', 'a:b', '̀a', 'a>', ''):
+            with self.subTest(key=key):
+                parser = expat.ParserCreate(namespace_separator='}')
+                try:
+                    parser.Parse(f'<{key}>a</{key}>', True)
+                    expected = True
+                except expat.ExpatError:
+                    expected = False
+                self.assertEqual(validate_xml_key(key), expected)
+        for value in ('text', 'a < b & c', 'tab\tnew\nline', '😀', 10):
+            self.assertTrue(validate_xml_value(value))
+        for value in ('\x00', 'a\x1fb', '\ufffe'):
+            self.assertFalse(validate_xml_value(value))
+        self.assertTrue(validate_xml_dict({'a': {'b': {'c': 1}, 'd': ''}}))
+        self.assertFalse(validate_xml_dict({'a': {'b': {'1c': 1}}}))
+        self.assertFalse(validate_xml_dict({'a': {'b': '\x00'}}))
+        self.assertFalse(validate_xml_dict({'a': [1, [{'2b': 2}]]}))
+
+    def test_xml_lists_and_depth(self):
+        """Test converting lists, and dictionaries deeper than the recursion limit, to XML."""
+        xml_string = dict_to_xml_string({'a': [1, {'b': 2, 'c': []}, [3, 4]],
+                                         'd': {'e': 'x < y', 'f': ''}})
+        self.assertEqual(xml_string, b'<root><a>1</a><a><b>2</b><c /></a><a>3</a><a>4</a>'
+                                     b'<d><e>x &lt; y</e><f /></d></root>')
+        depth = sys.getrecursionlimit() * 2
+        root = node = {}
+        for num in range(depth):
+            node['value'] = num
+            node['nested'] = node = {}
+        elem = ET.fromstring(dict_to_xml_string(root))
+        for num in range(depth):
+            self.assertEqual(elem.find('value').text, str(num))
+            elem = elem.find('nested')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,119 @@
+"""Unit test for encryption."""
+import os
+import sys
+import pickle
+import unittest
+from unittest import mock
+from os.path import dirname, join, abspath
+import rsa
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from encryption import EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY
+from encryption import cipher, start_decrypt_pool, decrypt_many, DecryptContext
+from encryption import keyring, get_example_pub_key, KeyPool
+
+
+class TestEncryption(unittest.TestCase):
+    """Unit test for encryption."""
+
+    def test_hybrid(self):
+        """Test hybrid encryption of messages larger than an RSA block."""
+        tests = ['', 'short text', 'long text ' * 10000]
+        for test in tests:
+            with self.subTest(size=len(test)):
+                encrypted = cipher.hybrid_encrypt(test, EXAMPLE_PUB_KEY)
+                self.assertEqual(
+                    cipher.hybrid_decrypt(encrypted, EXAMPLE_PRIV_KEY).decode('utf-8'), test)
+
+    def test_symmetric_tampered(self):
+        """Test that tampered ciphertext is rejected."""
+        key = cipher.generate_session_key()
+        encrypted = bytearray(cipher.symmetric_encrypt(b'message', key))
+        encrypted[cipher.NONCE_SIZE] ^= 1
+        with self.assertRaises(rsa.pkcs1.DecryptionError):
+            cipher.symmetric_decrypt(encrypted, key)
+        with self.assertRaises(rsa.pkcs1.DecryptionError):
+            cipher.symmetric_decrypt(b'short', key)
+        # The keystream and the tag use separate keys derived from the session key
+        encrypt_key, mac_key = cipher.session_subkeys(key)
+        self.assertNotIn(key, (encrypt_key, mac_key))
+        self.assertNotEqual(encrypt_key, mac_key)
+        # Messages spanning several keystream chunks are decrypted whole
+        message = os.urandom(cipher.KEYSTREAM_CHUNK_SIZE * 2 + 5)
+        self.assertEqual(cipher.symmetric_decrypt(cipher.symmetric_encrypt(message, key), key),
+                         message)
+
+    def test_stream(self):
+        """Test streaming encryption with chunks of any size."""
+        message = os.urandom(3000)
+        chunks = [message[i:i + 700] for i in range(0, len(message), 700)]
+        encrypted = list(cipher.encrypt_stream(chunks, EXAMPLE_PUB_KEY))
+        self.assertEqual(sum(len(block) for block in encrypted),
+                         cipher.encrypted_stream_size(len(message), EXAMPLE_PUB_KEY))
+        encrypted = b''.join(encrypted)
+        chunks = [encrypted[i:i + 1000] for i in range(0, len(encrypted), 1000)]
+        self.assertEqual(b''.join(cipher.decrypt_stream(chunks, EXAMPLE_PRIV_KEY)), message)
+
+    def test_decrypt_many(self):
+        """Test parallel decryption in a process pool keeps the order of blocks."""
+        messages = [os.urandom(100) for _ in range(5)]
+        blocks = [rsa.encrypt(message, EXAMPLE_PUB_KEY) for message in messages]
+        with start_decrypt_pool(EXAMPLE_PRIV_KEY, workers=2) as pool:
+            self.assertEqual(decrypt_many(pool, blocks, batch_size=2), messages)
+
+    def test_decrypt_context(self):
+        """Test that the decryption context matches rsa.decrypt."""
+        context = DecryptContext(EXAMPLE_PRIV_KEY)
+        contexts = [context, DecryptContext(EXAMPLE_PRIV_KEY, blinding=False),
+                    pickle.loads(pickle.dumps(context))]
+        for num, test_context in enumerate(contexts):
+            for size in (0, 1, 100, cipher.max_message_size(EXAMPLE_PUB_KEY)):
+                with self.subTest(context=num, size=size):
+                    message = os.urandom(size)
+                    block = rsa.encrypt(message, EXAMPLE_PUB_KEY)
+                    # Decrypt twice to use the updated blinding factor
+                    self.assertEqual(test_context.decrypt(block), message)
+                    self.assertEqual(test_context.decrypt(block), message)
+                    self.assertEqual(cipher.hybrid_decrypt(cipher.hybrid_encrypt(
+                        message, EXAMPLE_PUB_KEY), test_context), message)
+        with self.assertRaises(rsa.pkcs1.DecryptionError):
+            context.decrypt(os.urandom(context.key_size))
+
+    def test_key_cache(self):
+        """Test that keys are parsed again only when the file changes."""
+        keypath = join(dirname(__file__), '..', 'encryption',
+                       'example_keys', 'keys_2048_pub.pem')
+        keyring.clear_key_cache()
+        pub_key = keyring.load_pub_key_cached(keypath)
+        self.assertIs(keyring.load_pub_key_cached(keypath), pub_key)
+        stat = os.stat(keypath)
+        try:
+            os.utime(keypath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+            reloaded_key = keyring.load_pub_key_cached(keypath)
+            self.assertIsNot(reloaded_key, pub_key)
+            self.assertEqual(reloaded_key, pub_key)
+            self.assertEqual(len(keyring.KEY_CACHE), 1)
+        finally:
+            os.utime(keypath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIs(get_example_pub_key(), EXAMPLE_PUB_KEY)
+
+    def test_key_pool(self):
+        """Test that the key pool hands out distinct, working key pairs."""
+        for poolsize in (1, 2):
+            with self.subTest(poolsize=poolsize), \
+                    KeyPool(keysize=512, size=2, workers=2, poolsize=poolsize) as pool:
+                pairs = [pool.get_keys(timeout=60) for _ in range(3)]
+                self.assertNotEqual(pairs[0][0], pairs[1][0])
+                for pub_key, priv_key in pairs:
+                    self.assertEqual(rsa.decrypt(rsa.encrypt(b'key', pub_key), priv_key), b'key')
+        # A failed generation is raised to one caller and replaced, so the pool keeps its size
+        keys = (EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY)
+        with mock.patch('encryption.keypool.generate_keys',
+                        side_effect=[OSError('no entropy'), keys, keys]), \
+                KeyPool(size=1, workers=1, poolsize=2) as pool:
+            with self.assertRaises(OSError):
+                pool.get_keys(timeout=5)
+            self.assertEqual(pool.get_keys(timeout=5), keys)
+
+
+if __name__ == "__main__":
+    unittest.main()
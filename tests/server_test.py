@@ -8,13 +8,21 @@ from io import StringIO
 import codecs
 import json
 import os
+import socket
+import asyncio
+import tempfile
+import threading
 from os.path import dirname, join, abspath
 import xml.etree.ElementTree as ET
+from xml.dom.minidom import parseString
 import rsa
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
 from tests import testcase
-from encryption import EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY
-from cs_network import server, process_data
+from encryption import EXAMPLE_PUB_KEY, EXAMPLE_PRIV_KEY, start_decrypt_pool
+from cs_network import server, process_data, client, aio, update_session, xmlstream
+from cs_network import dict_to_xml_string, SegmentLog, iter_log, LatencyStats
+from cs_network.segment_log import list_segments
+from cs_network.functions import HEADER, MAX_CONFIG_SIZE
 
 
 class TestServer(unittest.TestCase):
@@ -217,6 +225,552 @@ class TestServer(unittest.TestCase):
                     self.assertEqual(outputs,
                                      test[2]['term_out'])
 
+    def test_serve_forever_concurrent(self):
+        """Test that several open connections are served at the same time."""
+        sock = server.initialize_server('127.0.0.1', 0, backlog=4)
+        port = sock.getsockname()[1]
+        stop_event = threading.Event()
+        serv_conf = testcase.server_case_2['output_config']
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            thread = threading.Thread(
+                target=server.serve_forever,
+                args=(sock, serv_conf, EXAMPLE_PRIV_KEY),
+                kwargs={'workers': 3, 'stop_event': stop_event, 'poll_interval': 0.05})
+            thread.start()
+            # All connections stay open while the messages are exchanged
+            socks = [client.initialize_client('127.0.0.1', port) for _ in range(3)]
+            try:
+                for sock_num, csock in enumerate(socks):
+                    send_config, data = process_data(
+                        testcase.test_case_3['output_config'], {'client': sock_num})
+                    client.send_with_retry(csock, json.dumps(send_config).encode('utf-8'))
+                    self.assertEqual(client.wait_for_response(csock, timeout=5), b'CONFIG_OK')
+                    client.send_with_retry(csock, data)
+                    self.assertEqual(client.wait_for_response(csock, timeout=5), b'DATA_OK')
+            finally:
+                for csock in socks:
+                    client.send_with_retry(csock, b'0')
+                    csock.close()
+                stop_event.set()
+                thread.join()
+                sock.close()
+
+    def test_serve_forever_drain(self):
+        """Test that stopping the server drains the open connections."""
+        sock = server.initialize_server('127.0.0.1', 0, backlog=4)
+        port = sock.getsockname()[1]
+        stop_event = threading.Event()
+        serv_conf = testcase.server_case_2['output_config']
+        args = server.parse_args(['--port', str(port), '--workers', '2', '--drain-timeout', '0.2'])
+        self.assertEqual((args.port, args.workers, args.output_dir), (port, 2, None))
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            thread = threading.Thread(
+                target=server.serve_forever,
+                args=(sock, serv_conf, EXAMPLE_PRIV_KEY),
+                kwargs={'stop_event': stop_event, 'poll_interval': 0.05,
+                        'drain_timeout': args.drain_timeout})
+            thread.start()
+            with client.Client('127.0.0.1', port) as test_client:
+                self.assertEqual(test_client.send({'a': 1}), 'DATA_OK')
+                stop_event.set()
+                # The open connection is still served until the drain timeout
+                self.assertEqual(test_client.send({'b': 2}), 'DATA_OK')
+                thread.join(timeout=5)
+                self.assertFalse(thread.is_alive())
+            sock.close()
+
+    def test_serve_client_errors(self):
+        """Test that errors are reported to the client and the console, and interrupts return."""
+        sender, receiver = socket.socketpair()
+        serv_conf = testcase.server_case_2['output_config']
+        with sender, mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            thread = threading.Thread(target=server.serve_client,
+                                      args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+            thread.start()
+            # The config has no encrypt type, so processing the data raises a KeyError
+            client.send_with_retry(sender, json.dumps({'type': 1, 'serialize': 2}).encode())
+            self.assertEqual(client.wait_for_response(sender, timeout=5), b'CONFIG_OK')
+            client.send_with_retry(sender, b'{}')
+            self.assertEqual(client.wait_for_response(sender, timeout=5), b'DATA_ERROR: KeyError')
+            # The connection is kept, and an invalid continue flag closes it with a log
+            client.send_with_retry(sender, b'yes')
+            thread.join()
+        self.assertIn('KeyError', mock_stdout.getvalue())
+        self.assertIn('closed after an error: ValueError', mock_stdout.getvalue())
+        # The interrupt is raised while a connection is blocked receiving its config
+        sender, receiver = socket.socketpair()
+        listener = mock.Mock()
+        listener.accept.side_effect = [(receiver, 'socketpair'), KeyboardInterrupt]
+        with sender, mock.patch('sys.stdout', new_callable=StringIO):
+            with self.assertRaises(KeyboardInterrupt):
+                server.serve_forever(listener, serv_conf, EXAMPLE_PRIV_KEY)
+
+    def test_client_api(self):
+        """Test sending dictionaries and texts with the Client object."""
+        sock = server.initialize_server('127.0.0.1', 0, backlog=4)
+        port = sock.getsockname()[1]
+        stop_event = threading.Event()
+        serv_conf = testcase.server_case_2['output_config']
+        objs = [{'message': num} if num % 3 else f'text {num}' for num in range(12)]
+        with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            thread = threading.Thread(
+                target=server.serve_forever,
+                args=(sock, serv_conf, EXAMPLE_PRIV_KEY),
+                kwargs={'stop_event': stop_event, 'poll_interval': 0.05})
+            thread.start()
+            try:
+                with client.Client('127.0.0.1', port, serialize=2) as plain_client:
+                    self.assertEqual(plain_client.send({'a': 1}), 'DATA_OK')
+                    self.assertEqual(plain_client.send_many(objs), ['DATA_OK'] * 12)
+                    self.assertEqual(plain_client.send_many(objs, batch_size=5), ['DATA_OK'] * 12)
+                with client.Client('127.0.0.1', port, encrypt=1) as encrypted_client:
+                    self.assertEqual(encrypted_client.send_many(objs), ['DATA_OK'] * 12)
+                with client.Client('127.0.0.1', port, serialize=3,
+                                   compress='lzma') as compressed_client:
+                    self.assertEqual(compressed_client.send_many(objs, batch_size=5),
+                                     ['DATA_OK'] * 12)
+            finally:
+                stop_event.set()
+                thread.join()
+                sock.close()
+        self.assertIn("'text 9'", mock_stdout.getvalue())
+        self.assertRaises(ValueError, client.Client, '127.0.0.1', port, serialize=5)
+        self.assertRaises(ValueError, client.Client, '127.0.0.1', port, compress='gzip')
+
+    def test_async_server(self):
+        """Test that the asyncio server serves concurrent clients."""
+        serv_conf = testcase.server_case_2['output_config']
+        messages = [[(testcase.test_case_2['output_config'], {'client': num, 'message': msg})
+                     for msg in range(3)] for num in range(5)]
+        encrypted_config = testcase.test_case_1['input_config'] | {
+            'public_key': EXAMPLE_PUB_KEY, 'serialize': 1}
+        messages.append([(encrypted_config, testcase.test_case_1['input_data'])] * 2)
+
+        async def run() -> list:
+            async_server = await aio.async_start_server(
+                '127.0.0.1', 0, serv_conf, EXAMPLE_PRIV_KEY)
+            port = async_server.sockets[0].getsockname()[1]
+            async with async_server:
+                return await asyncio.gather(*(
+                    aio.async_send_messages('127.0.0.1', port, message)
+                    for message in messages))
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            statuses = asyncio.run(run())
+        self.assertEqual(statuses, [['DATA_OK'] * len(message) for message in messages])
+
+    def test_framing(self):
+        """Test that messages arrive whole and separately over a socket pair."""
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            payload = os.urandom(200000)
+            thread = threading.Thread(target=lambda: (
+                client.send_with_retry(sender, payload),
+                client.send_with_retry(sender, b'1')))
+            thread.start()
+            self.assertEqual(server.receive_data(receiver), payload)
+            self.assertEqual(server.receive_data(receiver), b'1')
+            thread.join()
+            # A buffer smaller than the message grows as the bytes arrive
+            with mock.patch('cs_network.functions.INITIAL_BUFFER_SIZE', 4096):
+                thread = threading.Thread(target=client.send_with_retry, args=(sender, payload))
+                thread.start()
+                self.assertEqual(server.receive_data(receiver), payload)
+                thread.join()
+            # A config larger than the config limit is rejected from its header
+            sender.sendall(HEADER.pack(MAX_CONFIG_SIZE + 1))
+            with self.assertRaises(ConnectionError):
+                server.receive_config(receiver)
+            sender.close()
+            with self.assertRaises(ConnectionError):
+                server.receive_data(receiver)
+
+    def test_process_hybrid_data(self):
+        """Test for encrypted data larger than an RSA block."""
+        input_data = {str(num): 'value' * 20 for num in range(200)}
+        test_config, test_data = process_data(
+            testcase.test_case_1['input_config'] | {
+            'public_key': EXAMPLE_PUB_KEY, 'serialize': 1},
+            input_data)
+        self.assertEqual(test_config['cipher'], 'hybrid')
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            with mock.patch.object(server, 'print_dict') as mock_print:
+                status_msg = server.process_recv_data(
+                    test_config, test_data, testcase.server_case_2['output_config'],
+                    priv_key=EXAMPLE_PRIV_KEY)
+        self.assertEqual(status_msg, 'DATA_OK')
+        mock_print.assert_called_once_with(input_data)
+
+    def test_process_compressed_data(self):
+        """Test that compressed data is decompressed before deserializing and after decrypting."""
+        input_data = {str(num): 'value ' * 20 for num in range(100)}
+        configs = [
+            {'type': 1, 'encrypt': 2, 'serialize': 1},
+            {'type': 1, 'encrypt': 2, 'serialize': 2},
+            {'type': 1, 'encrypt': 2, 'serialize': 3},
+            {'type': 1, 'encrypt': 2, 'serialize': 4},
+            {'type': 1, 'encrypt': 1, 'serialize': 1, 'public_key': EXAMPLE_PUB_KEY},
+        ]
+        for config in configs:
+            for method in ('zlib', 'lzma', 'bz2'):
+                with self.subTest(config=config, method=method), \
+                        mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                    _, plain_data = process_data(config, input_data)
+                    test_config, test_data = process_data(config | {'compress': method},
+                                                          input_data)
+                    self.assertLess(len(test_data), len(plain_data) / 2)
+                    status_msg = server.process_recv_data(
+                        test_config, test_data, testcase.server_case_2['output_config'],
+                        priv_key=EXAMPLE_PRIV_KEY)
+                    self.assertEqual(status_msg, 'DATA_OK')
+                    self.assertIn('value ' * 20, mock_stdout.getvalue())
+        # Small payloads are sent as they are, with a flag byte
+        config = {'type': 2, 'encrypt': 2, 'serialize': None, 'compress': 'zlib'}
+        test_config, test_data = process_data(config, 'short text')
+        self.assertEqual(test_data, b'\x00short text')
+        with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            status_msg = server.process_recv_data(
+                test_config, test_data, testcase.server_case_2['output_config'])
+        self.assertEqual(status_msg, 'DATA_OK')
+        self.assertIn('short text', mock_stdout.getvalue())
+        # Corrupted data is rejected instead of raising
+        test_config, test_data = process_data(config, 'long text ' * 100)
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            status_msg = server.process_recv_data(
+                test_config, test_data[:-4], testcase.server_case_2['output_config'])
+        self.assertEqual(status_msg, 'DATA_ERROR: Invalid compressed data')
+
+    def test_process_session_data(self):
+        """Test that the session key is decrypted once per session."""
+        config = testcase.test_case_1['input_config'] | {
+            'public_key': EXAMPLE_PUB_KEY, 'serialize': 1}
+        session = update_session(None, config)
+        sessions = {}
+        with mock.patch('sys.stdout', new_callable=StringIO), \
+                mock.patch.object(server, 'open_session', wraps=server.open_session) as mock_open:
+            for num in range(3):
+                test_config, test_data = process_data(config, {'message': num}, session)
+                self.assertEqual('session_key' in test_config, num == 0)
+                status_msg = server.process_recv_data(
+                    test_config, test_data, testcase.server_case_2['output_config'],
+                    priv_key=EXAMPLE_PRIV_KEY, sessions=sessions)
+                self.assertEqual(status_msg, 'DATA_OK')
+            self.assertEqual(mock_open.call_count, 1)
+        # A message for an unknown session is rejected
+        with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            status_msg = server.process_recv_data(
+                test_config, test_data, testcase.server_case_2['output_config'],
+                priv_key=EXAMPLE_PRIV_KEY)
+        self.assertTrue(status_msg.startswith('DATA_ERROR'))
+        self.assertIn('Unknown session', mock_stdout.getvalue())
+
+    def test_process_msgpack_data(self):
+        """Test that MessagePack data is deserialized and written correctly."""
+        input_data = {'testkey': 'testvalue', '123': 456, 'nested_dict': {'nest': [1.5, None]}}
+        config = {'type': 1, 'encrypt': 2, 'serialize': 4}
+        test_config, test_data = process_data(config, input_data)
+        self.assertLess(len(test_data), len(json.dumps(input_data)))
+        with mock.patch('cs_network.server.print_to_terminal') as mock_print:
+            status_msg = server.process_recv_data(
+                test_config, test_data, testcase.server_case_2['output_config'])
+        self.assertEqual(status_msg, 'DATA_OK')
+        mock_print.assert_called_once_with(input_data)
+        serv_conf = {'output_method': 1, 'filepath': join(dirname(__file__), 'msgpack_test')}
+        with mock.patch('cs_network.server.print_to_terminal') as mock_print:
+            status_msg = server.process_recv_data(test_config, test_data, serv_conf)
+        filepath = mock_print.call_args[0][0].split('written to ')[1]
+        with open(filepath, 'rb') as file:
+            self.assertEqual(file.read(), test_data)
+        os.remove(filepath)
+        # Malformed data is rejected instead of raising
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            status_msg = server.process_recv_data(
+                test_config, test_data[:-1], testcase.server_case_2['output_config'])
+        self.assertEqual(status_msg, 'DATA_ERROR: Invalid MessagePack data')
+
+    def test_pretty_xml(self):
+        """Test that XML is indented while it is parsed, as minidom does."""
+        input_data = {'testkey': 'test & "value"', 'empty': '',
+                      'nested_dict': {'nest': 'value', 'nest2': {'a': '1', 'b': '2'}}}
+        xml_string = dict_to_xml_string(input_data)
+        # Every key of the nested dictionaries is kept
+        self.assertEqual(
+            ET.fromstring(xml_string).find('nested_dict/nest2/b').text, '2')
+        output = StringIO()
+        xmlstream.write_pretty_xml(xml_string, output.write, chunk_size=7)
+        self.assertEqual(output.getvalue(), parseString(xml_string).toprettyxml(
+            indent='\t', encoding='utf-8').decode('utf-8').strip())
+        self.assertEqual(list(xmlstream.iter_children(b'<batch><a>1</a><b /></batch>')),
+                         ['<a>1</a>', '<b />'])
+
+    def test_process_batch(self):
+        """Test that the records of a batch are deserialized and written together."""
+        records = [{'message': num, 'nested': {'num': str(num)}} for num in range(5)]
+        configs = [
+            {'type': 1, 'encrypt': 2, 'serialize': 1},
+            {'type': 1, 'encrypt': 2, 'serialize': 2},
+            {'type': 1, 'encrypt': 2, 'serialize': 3},
+            {'type': 1, 'encrypt': 2, 'serialize': 4},
+            {'type': 1, 'encrypt': 1, 'serialize': 1, 'public_key': EXAMPLE_PUB_KEY},
+        ]
+        for config in configs:
+            with self.subTest(config=config), \
+                    mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                test_config, test_data = client.process_batch(
+                    config, records, update_session(None, config))
+                status_msg = server.process_recv_data(
+                    test_config, test_data, testcase.server_case_2['output_config'],
+                    priv_key=EXAMPLE_PRIV_KEY)
+                self.assertEqual(status_msg, 'DATA_OK')
+                self.assertEqual(mock_stdout.getvalue().count('Start'), len(records))
+        # The records of a batch are written to one file
+        serv_conf = {'output_method': 1, 'filepath': join(dirname(__file__), 'batch_test')}
+        texts = [f'line {num}' for num in range(5)]
+        test_config, test_data = client.process_batch(
+            {'type': 2, 'encrypt': 2, 'serialize': None, 'txtfilepath': None}, texts)
+        with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            status_msg = server.process_recv_data(test_config, test_data, serv_conf)
+        self.assertEqual(status_msg, 'DATA_OK')
+        filepath = mock_stdout.getvalue().split('written to ')[1].split("'")[0]
+        with open(filepath, encoding='utf-8') as file:
+            self.assertEqual(file.read().splitlines(), texts)
+        os.remove(filepath)
+
+    def test_encrypted_file(self):
+        """Test sending a text file with streaming encryption, decrypted in a process pool."""
+        text = 'encrypted file line\n' * 100
+        filepath = join(dirname(__file__), 'stream_test_input.txt')
+        with open(filepath, 'w', encoding='utf-8') as file:
+            file.write(text)
+        sender, receiver = socket.socketpair()
+        serv_conf = testcase.server_case_2['output_config']
+        try:
+            with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout, \
+                    start_decrypt_pool(EXAMPLE_PRIV_KEY, workers=2) as pool:
+                thread = threading.Thread(
+                    target=server.handle_connection,
+                    args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY),
+                    kwargs={'decrypt_pool': pool})
+                thread.start()
+                status_msg = client.send_encrypted_file(sender, filepath, EXAMPLE_PUB_KEY)
+                client.send_with_retry(sender, b'0')
+                thread.join()
+            self.assertEqual(status_msg, 'DATA_OK')
+            self.assertIn(repr(text), mock_stdout.getvalue())
+        finally:
+            sender.close()
+            os.remove(filepath)
+
+    def test_send_file(self):
+        """Test that files are sent with sendfile and received straight into a file."""
+        with tempfile.TemporaryDirectory() as folder:
+            filepath = join(folder, 'data file.bin')
+            content = os.urandom(3 << 20)
+            with open(filepath, 'wb') as file:
+                file.write(content)
+            serv_conf = {'output_method': 1, 'filepath': join(folder, 'received')}
+            sender, receiver = socket.socketpair()
+            with sender, mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                thread = threading.Thread(
+                    target=server.handle_connection,
+                    args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+                thread.start()
+                # Files with the same name in the same second are kept apart
+                statuses = []
+                for cont in (b'1', b'0'):
+                    statuses.append(client.send_file(sender, filepath))
+                    client.send_with_retry(sender, cont)
+                thread.join()
+            self.assertEqual(statuses, ['DATA_OK'] * 2)
+            received = sorted(path for path in os.listdir(folder) if path.startswith('received'))
+            self.assertEqual(len(received), 2)
+            self.assertTrue(received[0].endswith('_data_file.bin'))
+            for path in received:
+                with open(join(folder, path), 'rb') as file:
+                    self.assertEqual(file.read(), content)
+            self.assertIn('written to', mock_stdout.getvalue())
+            # The threaded and asyncio servers print a summary of files to the console
+            serv_conf = testcase.server_case_2['output_config']
+            sock = server.initialize_server('127.0.0.1', 0, backlog=4)
+            stop_event = threading.Event()
+
+            async def run_async(port: list, started: threading.Event) -> None:
+                async_server = await aio.async_start_server('127.0.0.1', 0, serv_conf,
+                                                            EXAMPLE_PRIV_KEY)
+                port.append(async_server.sockets[0].getsockname()[1])
+                started.set()
+                async with async_server:
+                    while not stop_event.is_set():
+                        await asyncio.sleep(0.05)
+
+            with mock.patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                async_port, started = [], threading.Event()
+                threads = [
+                    threading.Thread(target=server.serve_forever,
+                                     args=(sock, serv_conf, EXAMPLE_PRIV_KEY),
+                                     kwargs={'stop_event': stop_event, 'poll_interval': 0.05}),
+                    threading.Thread(target=asyncio.run, args=(run_async(async_port, started),))]
+                for thread in threads:
+                    thread.start()
+                started.wait()
+                try:
+                    for port in (sock.getsockname()[1], async_port[0]):
+                        with client.Client('127.0.0.1', port) as file_client:
+                            self.assertEqual(file_client.send_file(filepath), 'DATA_OK')
+                            self.assertEqual(file_client.send({'a': 1}), 'DATA_OK')
+                            self.assertEqual(file_client.send_file(filepath), 'DATA_OK')
+                finally:
+                    stop_event.set()
+                    for thread in threads:
+                        thread.join()
+                    sock.close()
+            self.assertEqual(mock_stdout.getvalue().count(f'data file.bin of {3 << 20} bytes'), 4)
+
+    def test_config_session(self):
+        """Test that unchanged configs are sent as a config id in one round trip."""
+        sender, receiver = socket.socketpair()
+        serv_conf = testcase.server_case_2['output_config']
+        config_cache = {}
+        statuses = []
+        with sender, mock.patch('sys.stdout', new_callable=StringIO):
+            thread = threading.Thread(
+                target=server.handle_connection,
+                args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+            thread.start()
+            with mock.patch.object(client, 'wait_for_response',
+                                   wraps=client.wait_for_response) as mock_wait:
+                for num in range(3):
+                    send_config, data = process_data(
+                        testcase.test_case_3['output_config'], {'message': num})
+                    statuses.append(client.send_session_message(
+                        sender, send_config, data, config_cache))
+            # A config id unknown to the server is rejected
+            client.send_messages(sender, [b'{"config_id": "unknown"}', b'{}'])
+            unknown = client.wait_for_response(sender)
+            client.send_with_retry(sender, b'0')
+            thread.join()
+        self.assertEqual(statuses, ['DATA_OK'] * 3)
+        # CONFIG_OK for the first message, then one response for each message
+        self.assertEqual(mock_wait.call_count, 4)
+        self.assertEqual(unknown, b'DATA_ERROR: Unknown config_id')
+
+    def test_pipelined(self):
+        """Test that pipelined messages are acknowledged by sequence number."""
+        sender, receiver = socket.socketpair()
+        serv_conf = testcase.server_case_2['output_config']
+        messages = [process_data(testcase.test_case_3['output_config'], {'message': num})
+                    for num in range(20)]
+        # A changed config in the middle is confirmed before its data is sent
+        messages[10] = process_data({'type': 1, 'encrypt': 2, 'serialize': 1}, {'message': 10})
+        with sender, mock.patch('sys.stdout', new_callable=StringIO):
+            thread = threading.Thread(
+                target=server.handle_connection,
+                args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+            thread.start()
+            statuses = client.send_pipelined(sender, messages, {}, window=4)
+            # Lock-step messages still work after pipelined ones
+            send_config, data = process_data(testcase.test_case_3['output_config'], {'a': 1})
+            status = client.send_session_message(sender, send_config, data, {})
+            client.send_with_retry(sender, b'0')
+            thread.join()
+        self.assertEqual(statuses, ['DATA_OK'] * 20)
+        self.assertEqual(status, 'DATA_OK')
+        # Invalid data is acknowledged with an error, and the messages after the
+        # first one of a session wait for its key even when opening it is slow
+        config = {'type': 1, 'encrypt': 1, 'serialize': 1, 'public_key': EXAMPLE_PUB_KEY}
+        session = update_session(None, config)
+        messages = [process_data(config, {'message': num}, session) for num in range(6)]
+        messages.append((messages[0][0] | {'session_key': None, 'cipher': None}, b'{invalid'))
+        open_session = server.open_session
+        sender, receiver = socket.socketpair()
+        with sender, mock.patch('sys.stdout', new_callable=StringIO), \
+                mock.patch('cs_network.server.open_session',
+                           lambda *args: time.sleep(0.05) or open_session(*args)):
+            thread = threading.Thread(
+                target=server.handle_connection,
+                args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+            thread.start()
+            statuses = client.send_pipelined(sender, messages, {}, window=8, timeout=5)
+            client.send_with_retry(sender, b'0')
+            thread.join()
+        self.assertEqual(statuses[:6], ['DATA_OK'] * 6)
+        self.assertTrue(statuses[6].startswith('DATA_ERROR'))
+
+    def test_segment_log(self):
+        """Test that messages are appended to a segmented log with unique sequence numbers."""
+        with tempfile.TemporaryDirectory() as folder:
+            prefix = join(folder, 'log_test')
+            sink = SegmentLog(prefix, segment_bytes=1024)
+            serv_conf = {'output_method': 1, 'filepath': prefix, 'sink': sink}
+            messages = [process_data({'type': 1, 'encrypt': 2, 'serialize': 2}, {'message': num})
+                        for num in range(40)]
+            with mock.patch('sys.stdout', new_callable=StringIO):
+                threads = [threading.Thread(target=server.process_recv_data,
+                                            args=(*message, serv_conf)) for message in messages]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                status_msg = server.process_recv_data(
+                    {'type': 2, 'encrypt': 2, 'serialize': None}, b'text', serv_conf)
+            self.assertEqual(status_msg, 'DATA_OK')
+            sink.close()
+            records = list(iter_log(prefix))
+            self.assertEqual([record[0] for record in records], list(range(1, 42)))
+            self.assertEqual(sorted(json.loads(payload)['message'] for _, fmt, payload in records
+                                    if fmt == 'json'), list(range(40)))
+            self.assertEqual(records[-1][1:], ('txt', b'text'))
+            self.assertGreater(len(list_segments(prefix)), 1)
+            # An incomplete record is removed and the sequence numbers continue
+            with open(list_segments(prefix)[-1], 'ab') as segment:
+                segment.write(b'\x00' * 10)
+            with SegmentLog(prefix) as sink:
+                self.assertEqual(sink.append(b'after restart'), 42)
+            self.assertEqual(list(iter_log(prefix))[-1], (42, '', b'after restart'))
+
+    def test_latency_stats(self):
+        """Test that the stages of the messages are timed by serialization and encryption."""
+        sender, receiver = socket.socketpair()
+        stats = LatencyStats(window=8)
+        serv_conf = testcase.server_case_2['output_config'] | {'stats': stats}
+        encrypted_config = {'type': 1, 'encrypt': 1, 'serialize': 1, 'public_key': EXAMPLE_PUB_KEY}
+        with sender, mock.patch('sys.stdout', new_callable=StringIO):
+            thread = threading.Thread(
+                target=server.handle_connection,
+                args=(receiver, 'socketpair', serv_conf, EXAMPLE_PRIV_KEY))
+            thread.start()
+            for num in range(10):
+                send_config, data = process_data({'type': 1, 'encrypt': 2, 'serialize': 1},
+                                                 {'message': num})
+                status = client.send_session_message(sender, send_config, data, {})
+                self.assertEqual(status, 'DATA_OK')
+            send_config, data = process_data(encrypted_config, {'message': 'secret'})
+            # The idle time before a message is not timed
+            time.sleep(0.5)
+            self.assertEqual(client.send_session_message(sender, send_config, data, {}),
+                             'DATA_OK')
+            messages = [process_data({'type': 1, 'encrypt': 2, 'serialize': 2}, {'message': num})
+                        for num in range(4)]
+            self.assertEqual(client.send_pipelined(sender, messages, {}), ['DATA_OK'] * 4)
+            client.send_with_retry(sender, b'0')
+            thread.join()
+        summary = stats.summary()
+        self.assertEqual(set(summary), {(1, 2), (1, 1), (2, 2)})
+        # Only the latest samples are kept
+        self.assertEqual(summary[(1, 2)]['total']['count'], 8)
+        self.assertEqual(list(summary[(1, 1)]),
+                         ['recv_config', 'parse_config', 'recv_data', 'deserialize', 'decrypt',
+                          'literal_eval', 'output', 'send', 'total'])
+        self.assertIn('queue', summary[(2, 2)])
+        self.assertLess(summary[(1, 1)]['recv_config']['p99'], 100)
+        self.assertLess(summary[(1, 1)]['total']['p99'], 500)
+        for stages in summary.values():
+            for times in stages.values():
+                self.assertLessEqual(times['p50'], times['p95'])
+                self.assertLessEqual(times['p95'], times['p99'])
+        self.assertIn('serialize 1, encrypt 1', stats.report())
+        stats.reset()
+        self.assertEqual(stats.report(), 'No latency samples.')
+
 
 if __name__ == "__main__":
     unittest.main()